@@ -0,0 +1,188 @@
+import time
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from user_repo import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# (значение, потрачено токенов) или (значение, None) — фолбэк, не кешируем
+Computed = Tuple[Any, Optional[int]]
+
+
+class AICache:
+    """
+    Кеш ответов ИИ по ключу вида (функция, знак, язык, дата).
+
+    - TTL: запись живёт ttl секунд; LRU: не больше max_entries записей;
+    - single-flight: одновременные запросы одного ключа ждут один и тот же
+      вызов модели, а не шлют одинаковые промпты;
+    - диск (path): записи переживают рестарт; файл переписывается атомарно,
+      но не на каждую запись: новые записи копятся save_delay секунд и
+      пишутся одним разом в пуле потоков, цикл событий не ждёт диска
+      (flush() — дописать всё на остановке);
+    - stats: попадания, промахи, присоединения к идущему вызову
+      и сэкономленные токены (токены исходного ответа на каждый повтор).
+
+    Фолбэки (ИИ недоступен) не кешируются — в следующий раз снова пробуем ИИ.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 36 * 3600,
+        path: Optional[Path] = None,
+        save_delay: float = 5.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_delay = save_delay
+        self._dirty = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._saving: Optional[asyncio.Future] = None
+        # key -> (истекает в time.time(), значение, токены)
+        self._entries: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._loaded = False
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "shared": 0, "saved_tokens": 0}
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return "|".join(str(p) for p in parts)
+
+    def hit_rate(self) -> float:
+        served = self.stats["hits"] + self.stats["shared"]
+        total = served + self.stats["misses"]
+        return served / total if total else 0.0
+
+    # ------------------------------- диск -------------------------------
+
+    def _load(self) -> None:
+        self._loaded = True
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (expires, value, tokens) in sorted(data.items(), key=lambda kv: kv[1][0]):
+            if expires > now:
+                self._entries[key] = (expires, value, tokens)
+        self._trim()
+
+    def _write(self, entries: Dict[str, Tuple[float, Any, int]]) -> None:
+        try:
+            atomic_write_text(
+                self.path,
+                json.dumps(entries, ensure_ascii=False, separators=(",", ":")),
+            )
+        except Exception as e:
+            logger.error(f"Ошибка записи {self.path}: {e}")
+
+    def _schedule_save(self) -> None:
+        if self.path is None:
+            return
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # вне цикла событий (скрипты) — пишем сразу
+            self._dirty = False
+            self._write(dict(self._entries))
+            return
+        if self._save_handle is None:
+            self._save_handle = loop.call_later(self.save_delay, self._start_save)
+
+    def _start_save(self) -> None:
+        self._save_handle = None
+        if self._saving is not None and not self._saving.done():
+            # прошлая запись ещё идёт — попробуем позже, два писателя одного tmp не нужны
+            self._save_handle = asyncio.get_running_loop().call_later(self.save_delay, self._start_save)
+            return
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._saving = asyncio.get_running_loop().run_in_executor(None, self._write, dict(self._entries))
+
+    async def flush(self) -> None:
+        """Дописать на диск всё накопленное (на остановке бота)."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._saving is not None:
+            await self._saving
+            self._saving = None
+        if self._dirty and self.path is not None:
+            self._dirty = False
+            await asyncio.get_running_loop().run_in_executor(None, self._write, dict(self._entries))
+
+    # ------------------------------ память ------------------------------
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Tuple[Any, int]]:
+        if not self._loaded:
+            self._load()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value, tokens = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value, tokens
+
+    def put(self, key: str, value: Any, tokens: int) -> None:
+        if not self._loaded:
+            self._load()
+        self._entries[key] = (time.time() + self.ttl, value, tokens)
+        self._entries.move_to_end(key)
+        self._trim()
+        self._schedule_save()
+
+    # ---------------------------- single-flight ----------------------------
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Computed]]) -> Any:
+        cached = self.get(key)
+        if cached is not None:
+            value, tokens = cached
+            self.stats["hits"] += 1
+            self.stats["saved_tokens"] += tokens
+            return value
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["shared"] += 1
+            value, tokens = await asyncio.shield(fut)
+            self.stats["saved_tokens"] += tokens or 0
+            return value
+
+        self.stats["misses"] += 1
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        # исключение без ожидающих не должно ругаться «never retrieved»
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            value, tokens = await compute()
+            if tokens is not None:
+                self.put(key, value, tokens)
+            fut.set_result((value, tokens))
+            return value
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,211 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from settings import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    AI_MODEL,
+    AI_DEADLINE,
+    AI_CONCURRENCY,
+    AI_SLOW_CALL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель по последним window вызовам.
+
+    Неудача — исключение, дедлайн или ответ медленнее slow_call секунд.
+    Если среди последних вызовов (не меньше min_calls) доля неудач достигла
+    failure_rate, цепь размыкается на cooldown секунд: все вызовы сразу идут
+    в фолбэк. Затем пропускается одна пробная попытка — успех замыкает цепь,
+    неудача размыкает снова.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call: float = 8.0,
+        cooldown: float = 30.0,
+    ):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self._results: deque = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def abandon(self) -> None:
+        """Вызов отменён без результата: пробную попытку можно пустить снова."""
+        self._probing = False
+
+    def record(self, ok: bool, latency: float) -> None:
+        ok = ok and latency <= self.slow_call
+        if self._opened_at is not None:
+            if self._probing:
+                self._probing = False
+                if ok:
+                    logger.info("AI: цепь снова замкнута")
+                    self._opened_at = None
+                    self._results.clear()
+                else:
+                    self._opened_at = time.monotonic()
+            return
+        self._results.append(ok)
+        if len(self._results) < self.min_calls:
+            return
+        failures = self._results.count(False)
+        if failures / len(self._results) >= self.failure_rate:
+            logger.warning(f"AI: цепь разомкнута ({failures}/{len(self._results)} неудач)")
+            self._opened_at = time.monotonic()
+
+
+class AIClient:
+    """
+    Асинхронный доступ к OpenAI-совместимому API.
+
+    Один AsyncOpenAI (и его пул соединений httpx) на процесс, не больше
+    concurrency запросов одновременно, общий дедлайн deadline секунд на
+    запрос (вместе с ожиданием очереди) и CircuitBreaker. Любая неудача
+    или разомкнутая цепь — сразу fallback(), обработчик бота не ждёт.
+    base_url позволяет направить клиент на локальную заглушку.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        deadline: float = 10.0,
+        concurrency: int = 8,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.model = model
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._client = None
+        self.stats: Dict[str, int] = {"ok": 0, "failed": 0, "timeout": 0, "fallback": 0}
+        if api_key:
+            try:
+                from openai import AsyncOpenAI
+
+                # повторы и таймауты — наши, а не встроенные в SDK
+                self._client = AsyncOpenAI(
+                    api_key=api_key, base_url=base_url or None, max_retries=0, timeout=deadline
+                )
+            except Exception as e:
+                logger.warning(f"AI недоступен, работаем на шаблонах: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        return self._client is not None
+
+    async def _call(self, messages: List[Dict[str, str]], **params: Any) -> Tuple[str, int]:
+        async with self._sem:
+            resp = await self._client.chat.completions.create(
+                model=self.model, messages=messages, **params
+            )
+        text = (resp.choices[0].message.content or "").strip()
+        if not text:
+            raise ValueError("пустой ответ модели")
+        usage = getattr(resp, "usage", None)
+        return text, int(getattr(usage, "total_tokens", 0) or 0)
+
+    async def complete_with_usage(
+        self, messages: List[Dict[str, str]], fallback: Callable[[], Any], **params: Any
+    ) -> Tuple[Any, Optional[int]]:
+        """
+        (ответ модели, потрачено токенов) или (fallback(), None), если ИИ
+        выключен, медленный или сломан.
+        """
+        if not self.enabled or not self.breaker.allow():
+            self.stats["fallback"] += 1
+            return fallback(), None
+        started = time.monotonic()
+        try:
+            text, tokens = await asyncio.wait_for(
+                self._call(messages, **params), timeout=self.deadline
+            )
+        except asyncio.TimeoutError:
+            self.breaker.record(False, time.monotonic() - started)
+            self.stats["timeout"] += 1
+            self.stats["fallback"] += 1
+            logger.warning(f"AI: дедлайн {self.deadline}s, берём шаблон")
+            return fallback(), None
+        except Exception as e:
+            self.breaker.record(False, time.monotonic() - started)
+            self.stats["failed"] += 1
+            self.stats["fallback"] += 1
+            logger.warning(f"AI: ошибка запроса, берём шаблон: {e}")
+            return fallback(), None
+        except BaseException:
+            # отмена задачи (CancelledError) — ни успех, ни неудача, но пробную
+            # попытку надо отпустить, иначе цепь так и останется открытой
+            self.breaker.abandon()
+            raise
+        self.breaker.record(True, time.monotonic() - started)
+        self.stats["ok"] += 1
+        return text, tokens
+
+    async def complete(
+        self, messages: List[Dict[str, str]], fallback: Callable[[], Any], **params: Any
+    ) -> Any:
+        """Текст ответа модели или fallback(), если ИИ выключен, медленный или сломан."""
+        value, _ = await self.complete_with_usage(messages, fallback, **params)
+        return value
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+
+
+_client: Optional[AIClient] = None
+
+
+async def close_ai_client() -> None:
+    """Закрыть общий клиент на остановке бота (если он создавался)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def get_ai_client() -> AIClient:
+    """Общий клиент процесса (создаётся при первом обращении)."""
+    global _client
+    if _client is None:
+        _client = AIClient(
+            OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            model=AI_MODEL,
+            deadline=AI_DEADLINE,
+            concurrency=AI_CONCURRENCY,
+            breaker=CircuitBreaker(slow_call=AI_SLOW_CALL),
+        )
+    return _client
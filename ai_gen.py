@@ -1,29 +1,76 @@
-import os
-from openai import OpenAI
+import random
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from ai_cache import AICache
+from ai_client import get_ai_client
+from content import ZODIAC
+from generator import generate, SIGN_NAMES, TAROT_CARDS, TZ
+from settings import AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_FILE
 
-def ai_horoscope(sign_text: str, lang: str = "ru") -> str:
+# гороскоп ИИ меняется раз в день на знак/язык — его и кешируем
+ai_cache = AICache(
+    max_entries=AI_CACHE_SIZE,
+    ttl=AI_CACHE_TTL,
+    path=Path(__file__).parent / AI_CACHE_FILE if AI_CACHE_FILE else None,
+)
+
+
+_SIGN_KEYS = {
+    name.lower(): sign for names in SIGN_NAMES.values() for sign, name in names.items()
+}
+
+
+def _sign_key(sign_text: str) -> Optional[str]:
+    """'♌ Лев' / 'Лев' / 'leo' / 'Leo' -> 'Лев' (ключ ZODIAC_SIGNS); иначе None."""
+    text = sign_text.strip()
+    if text in ZODIAC:
+        text = ZODIAC[text]
+    for candidate in (text, text.split(" ", 1)[-1]):
+        key = _SIGN_KEYS.get(candidate.strip().lower())
+        if key:
+            return key
+    return None
+
+
+def _template_horoscope(sign: str, lang: str) -> str:
+    """Фолбэк: обычный гороскоп из PHRASES для того же знака."""
+    return generate(sign, lang)
+
+
+def _template_tarot() -> str:
+    card = random.choice(TAROT_CARDS)
+    return f"{card['title']['ru']}. {card['meaning']['ru']}"
+
+
+async def ai_horoscope(sign_text: str, lang: str = "ru") -> str:
+    sign = _sign_key(sign_text)
+    if sign is None:
+        raise ValueError(f"неизвестный знак зодиака: {sign_text!r}")
     prompt = (
-        f"Сделай красивый, вдохновляющий гороскоп для знака {sign_text}. "
+        f"Сделай красивый, вдохновляющий гороскоп для знака {sign}. "
         f"Структура: 💖 Любовь, 💼 Работа, 💰 Деньги, 🌿 Здоровье, 🎯 Совет. "
         f"Пиши по-русски, с лёгким позитивом, 6–8 предложений, без негативных формулировок."
     )
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role":"user","content":prompt}],
-        temperature=0.8,
+    key = AICache.key("ai_horoscope", sign, lang, datetime.now(TZ).date().isoformat())
+    return await ai_cache.get_or_compute(
+        key,
+        lambda: get_ai_client().complete_with_usage(
+            [{"role": "user", "content": prompt}],
+            fallback=lambda: _template_horoscope(sign, lang),
+            temperature=0.8,
+        ),
     )
-    return resp.choices[0].message.content.strip()
 
-def ai_tarot() -> str:
+
+async def ai_tarot() -> str:
     prompt = (
         "Выбери одну позитивную карту Таро дня (например: Солнце, Звезда, Мир, Сила). "
         "Дай название и короткую добрую трактовку (1–3 предложения), по-русски."
     )
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role":"user","content":prompt}],
+    return await get_ai_client().complete(
+        [{"role": "user", "content": prompt}],
+        fallback=_template_tarot,
         temperature=0.7,
     )
-    return resp.choices[0].message.content.strip()
@@ -0,0 +1,693 @@
+"""
+Бенчмарки AstroBot.
+
+    python bench.py updates --mode polling   # бот: TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=polling
+    python bench.py updates --mode webhook   # бот: то же, но BOT_MODE=webhook и без PUBLIC_URL
+    python bench.py router                   # таблица маршрутов vs старая цепочка lambda
+    python bench.py storage                  # storage.py: вставки/обновления в секунду
+    python bench.py store                    # logic.generate_message: ввод-вывод на сообщение, JSON против SQLite
+    python bench.py messages                 # журнал сообщений msglog.py против таблицы user_messages
+    python bench.py history                  # history.py: окна в памяти + журнал против JSON целиком
+    python bench.py ai --latency 0.2 --error-rate 0.3   # ai_client.py против локальной заглушки
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import timeit
+import sqlite3
+import tempfile
+from typing import Any, Dict, List
+
+
+def _report(title: str, samples: List[float]) -> None:
+    if not samples:
+        print(f"{title}: нет данных")
+        return
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{title}: n={len(samples)} "
+        f"mean={statistics.mean(samples) * 1000:.2f}ms "
+        f"p50={statistics.median(samples) * 1000:.2f}ms "
+        f"p95={p95 * 1000:.2f}ms"
+    )
+
+
+# ------------------------- updates: polling vs webhook -------------------------
+# Поднимаем фейковый Bot API. Для polling отдаём записанные апдейты через
+# getUpdates, для webhook — постим их в WEBHOOK_PATH бота. Задержка в обоих
+# режимах одна и та же: от момента, когда апдейт стал доступен боту,
+# до прихода его ответа (sendMessage/sendPhoto) в фейковый API.
+
+def _load_updates(path: str, count: int) -> List[Dict[str, Any]]:
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    now = int(time.time())
+    return [
+        {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": 100000 + i, "type": "private"},
+                "from": {"id": 100000 + i, "is_bot": False, "first_name": "Bench"},
+                "text": "/start",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+async def _bench_updates(args) -> None:
+    from aiohttp import web, ClientSession
+
+    pending: asyncio.Queue = asyncio.Queue()
+    replies: Dict[int, asyncio.Event] = {}
+
+    async def api(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getUpdates":
+            try:
+                upd = await asyncio.wait_for(pending.get(), timeout=10)
+                result: Any = [upd]
+            except asyncio.TimeoutError:
+                result = []
+            return web.json_response({"ok": True, "result": result})
+        if method == "getMe":
+            return web.json_response(
+                {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}
+            )
+        if method == "getWebhookInfo":
+            # skip_updates в polling сначала спрашивает вебхук — нужен объект, не true
+            return web.json_response(
+                {"ok": True, "result": {"url": "", "has_custom_certificate": False, "pending_update_count": 0}}
+            )
+        if method == "deleteWebhook":
+            return web.json_response({"ok": True, "result": True})
+        data = dict(await request.post()) if request.can_read_body else {}
+        if "chat_id" in data:
+            chat_id = int(data["chat_id"])
+            ev = replies.get(chat_id)
+            if ev is not None:
+                ev.set()
+            return web.json_response(
+                {
+                    "ok": True,
+                    "result": {
+                        "message_id": 1,
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "text": data.get("text", ""),
+                    },
+                }
+            )
+        return web.json_response({"ok": True, "result": True})
+
+    app = web.Application()
+    app.router.add_route("POST", "/bot{token}/{method}", api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    print(f"Фейковый Bot API: http://127.0.0.1:{args.api_port}")
+
+    updates = _load_updates(args.updates, args.count)
+    samples: List[float] = []
+    async with ClientSession() as http:
+        await asyncio.sleep(args.warmup)
+        for upd in updates:
+            chat_id = upd["message"]["chat"]["id"]
+            ev = replies[chat_id] = asyncio.Event()
+            t0 = time.perf_counter()
+            if args.mode == "webhook":
+                await http.post(args.webhook_url, json=upd)
+            else:
+                await pending.put(upd)
+            try:
+                await asyncio.wait_for(ev.wait(), timeout=10)
+                samples.append(time.perf_counter() - t0)
+            except asyncio.TimeoutError:
+                print(f"нет ответа на update_id={upd.get('update_id')}")
+            replies.pop(chat_id, None)
+
+    _report(f"updates[{args.mode}]", samples)
+    await runner.cleanup()
+
+
+def cmd_updates(args) -> None:
+    asyncio.run(_bench_updates(args))
+
+
+# ------------------------- router: dict vs lambda chain ------------------------
+
+def _legacy_filters(bot_mod) -> list:
+    """Фильтры в том виде и порядке, в каком они стояли на хэндлерах до ROUTES."""
+    UI = bot_mod.UI
+    SIGN_EMOJIS = bot_mod.SIGN_EMOJIS
+    cancel = {UI[l]["btn_cancel_reminders"] for l in UI}
+    back = {UI[l]["btn_back"] for l in UI}
+    return [
+        lambda m: m.text in {UI["ru"]["btn_lang_ru"], UI["ru"]["btn_lang_en"], UI["ru"]["btn_lang_es"]},
+        lambda m: m.text and (
+            m.text == UI["ru"]["btn_change_lang"]
+            or m.text == UI["en"]["btn_change_lang"]
+            or m.text == UI["es"]["btn_change_lang"]
+        ),
+        lambda m: m.text and m.text.startswith(tuple(SIGN_EMOJIS.values())) and "—" not in m.text,
+        lambda m: m.text
+        and any(
+            m.text.startswith(prefix)
+            for prefix in ["🐏", "🐂", "👥", "🦀", "🦁", "👩‍🦰", "⚖️", "🦂", "🏹", "🐐", "🌊", "🐟"]
+        )
+        and "—" in m.text,
+        lambda m: m.text and m.text in {UI["ru"]["btn_change_sign"], UI["en"]["btn_change_sign"], UI["es"]["btn_change_sign"]},
+        lambda m: m.text and m.text in {UI["ru"]["btn_tarot"], UI["en"]["btn_tarot"], UI["es"]["btn_tarot"]},
+        lambda m: m.text and m.text in {UI["ru"]["btn_reminder"], UI["en"]["btn_reminder"], UI["es"]["btn_reminder"]},
+        lambda m: m.text in cancel,
+        lambda m: m.text in back,
+        lambda m: m.text and ":" in m.text and len(m.text) in (4, 5) and m.text.replace(":", "").isdigit(),
+    ]
+
+
+def cmd_router(args) -> None:
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    import bot as bot_mod
+
+    class Msg:
+        __slots__ = ("text",)
+
+        def __init__(self, text: str):
+            self.text = text
+
+    texts = list(bot_mod.ROUTES) + ["09:30", "привет", "/unknown"]
+    messages = [Msg(t) for t in texts]
+    filters = _legacy_filters(bot_mod)
+    routes = bot_mod.ROUTES
+    is_time = bot_mod._is_time_text
+
+    def legacy():
+        for m in messages:
+            for f in filters:
+                if f(m):
+                    break
+
+    def table():
+        for m in messages:
+            if routes.get(m.text) is None:
+                is_time(m.text)
+
+    n = args.number
+    for title, fn in (("lambda-цепочка", legacy), ("ROUTES", table)):
+        best = min(timeit.repeat(fn, number=n, repeat=5))
+        per_msg = best / (n * len(messages)) * 1e6
+        print(f"{title}: {per_msg:.3f} мкс на сообщение ({len(messages)} текстов)")
+
+
+# ------------------------- storage: throughput до/после ------------------------
+
+def _legacy_set_sign(db_path: str, user_id: int, sign: str) -> None:
+    """Как было: upsert_user() и UPDATE — два отдельных соединения с коммитом."""
+    from datetime import datetime
+
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    for sql, params in (
+        (
+            "INSERT INTO users (user_id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET updated_at=excluded.updated_at",
+            (user_id, now, now),
+        ),
+        ("UPDATE users SET sign=?, updated_at=? WHERE user_id=?", (sign, now, user_id)),
+    ):
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(sql, params)
+        finally:
+            conn.commit()
+            conn.close()
+
+
+def cmd_storage(args) -> None:
+    tmp = tempfile.mkdtemp(prefix="astrobot-bench-")
+    os.environ["ASTROBOT_DB"] = os.path.join(tmp, "bench.db")
+    import storage
+
+    storage.init_db()
+    n = args.count
+
+    def rate(title: str, fn) -> None:
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        print(f"{title}: {n / dt:,.0f} оп/с ({dt:.2f}s на {n})")
+
+    # «до» пишет в свой файл в режиме journal_mode=DELETE, как старый storage.py
+    legacy_db = os.path.join(tmp, "legacy.db")
+    conn = sqlite3.connect(legacy_db)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, sign TEXT, created_at TEXT, updated_at TEXT)")
+    conn.close()
+    rate("до: insert (connect на вызов)", lambda: [_legacy_set_sign(legacy_db, i, "Овен") for i in range(n)])
+    rate("до: update (connect на вызов)", lambda: [_legacy_set_sign(legacy_db, i, "Лев") for i in range(n)])
+
+    rate("после: insert set_sign()", lambda: [storage.set_sign(i, "Овен") for i in range(n)])
+    rate("после: update set_sign()", lambda: [storage.set_sign(i, "Лев") for i in range(n)])
+    base = n
+    rate(
+        "после: insert apply_user_changes()",
+        lambda: storage.apply_user_changes((base + i, {"sign": "Овен", "daily_on": 1}) for i in range(n)),
+    )
+    rate(
+        "после: update apply_user_changes()",
+        lambda: storage.apply_user_changes((base + i, {"daily_time": "08:00"}) for i in range(n)),
+    )
+    storage.close_db()
+
+
+# ------------------- store: ввод-вывод на одно сообщение -----------------------
+
+class _LegacyJsonStore:
+    """
+    store.py до перехода на SQLite: весь storage.json читается на каждый
+    вызов и переписывается на каждое изменение. Считаем чтения, записи и байты.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.loads = 0
+        self.saves = 0
+        self.written = 0
+
+    def _load(self) -> Dict[str, Any]:
+        self.loads += 1
+        if not os.path.exists(self.path):
+            return {"users": {}, "monthly": {}}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        self.saves += 1
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            self.written += f.tell()
+        os.replace(tmp, self.path)
+
+    def get_user(self, user_id: int) -> Dict[str, Any]:
+        data = self._load()
+        u = data["users"].get(str(user_id))
+        if not u:
+            u = {"used": [], "last_month": None, "messages": [], "profile": {}}
+            data["users"][str(user_id)] = u
+            self._save(data)
+        return u
+
+    def put_user(self, user_id: int, user: Dict[str, Any]) -> None:
+        data = self._load()
+        data["users"][str(user_id)] = user
+        self._save(data)
+
+    def filter_allowed(self, user_id: int, templates, N: int = 6, days: int = 14):
+        from datetime import datetime, timedelta
+
+        u = self.get_user(user_id)
+        recent = sorted(u["used"], key=lambda x: x["ts"], reverse=True)[:N]
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        blocked = {x["id"] for x in recent} | {
+            x["id"] for x in u["used"] if datetime.fromisoformat(x["ts"]) >= cutoff
+        }
+        return [t for t in templates if t[0] not in blocked]
+
+    def remember_template(self, user_id: int, template_id: str) -> None:
+        from datetime import datetime
+
+        u = self.get_user(user_id)
+        u["used"].append({"id": template_id, "ts": datetime.utcnow().isoformat(timespec="seconds")})
+        u["used"] = u["used"][-200:]
+        self.put_user(user_id, u)
+
+    def monthly_reset_messages(self, user_id: int) -> None:
+        from datetime import datetime
+
+        u = self.get_user(user_id)
+        cur = datetime.utcnow().strftime("%Y-%m")
+        if u.get("last_month") != cur:
+            u["messages"] = []
+            u["last_month"] = cur
+            self.put_user(user_id, u)
+
+    def append_message(self, user_id: int, text: str) -> None:
+        from datetime import datetime
+
+        u = self.get_user(user_id)
+        self.monthly_reset_messages(user_id)
+        u["messages"].append({"ts": datetime.utcnow().isoformat(timespec="seconds"), "text": text[:500]})
+        u["messages"] = u["messages"][-500:]
+        self.put_user(user_id, u)
+
+
+def _legacy_generate_message(store: _LegacyJsonStore, user_id: int, zodiac: str) -> str:
+    """Как было в logic.generate_message: каждый шаг — отдельный вызов store."""
+    import random
+    from datetime import datetime
+    from content import get_season, SEASON_TEMPLATES
+
+    store.monthly_reset_messages(user_id)
+    pool = SEASON_TEMPLATES.get(get_season(datetime.utcnow()), [])
+    allowed = store.filter_allowed(user_id, pool, N=6, days=14) or pool
+    tid, line = random.choice(allowed)
+    store.remember_template(user_id, tid)
+    msg = f"{zodiac}\n{line}"
+    store.append_message(user_id, msg)
+    return msg
+
+
+def cmd_store(args) -> None:
+    tmp = tempfile.mkdtemp(prefix="astrobot-bench-")
+    os.environ["ASTROBOT_DB"] = os.path.join(tmp, "bench.db")
+    import storage
+    import store
+    import logic
+
+    users = range(args.users)
+    n = args.rounds * args.users
+
+    def timed(fn, reset) -> float:
+        for uid in users:  # прогрев: у всех есть запись, месяц уже сброшен
+            fn(uid)
+        reset()
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            for uid in users:
+                fn(uid)
+        return (time.perf_counter() - t0) / n * 1e6
+
+    # до: storage.json целиком на каждый шаг
+    legacy = _LegacyJsonStore(os.path.join(tmp, "storage.json"))
+
+    def reset_legacy() -> None:
+        legacy.loads = legacy.saves = legacy.written = 0
+
+    us = timed(lambda uid: _legacy_generate_message(legacy, uid, "♌ Лев"), reset_legacy)
+    print(
+        f"до: storage.json: {legacy.loads / n:.1f} чтений файла, {legacy.saves / n:.1f} перезаписей "
+        f"({legacy.written / n / 1024:.0f} КБ), {us:.0f} мкс на сообщение"
+    )
+
+    # после: SQLite-строки пользователя + дозапись в журнал сообщений
+    store._ensure()
+    statements: List[str] = []
+    appends = [0]
+    with storage.batch() as db:
+        db.set_trace_callback(statements.append)
+    log = store.messages_log()
+    append_many = log.append_many
+
+    def counted(items, ts=None):
+        appends[0] += 1
+        return append_many(items, ts)
+
+    log.append_many = counted
+
+    def reset_session() -> None:
+        statements.clear()
+        appends[0] = 0
+
+    us = timed(lambda uid: logic.generate_message(uid, "♌ Лев"), reset_session)
+    writes = sum(1 for st in statements if not st.lstrip().upper().startswith(("SELECT", "BEGIN", "COMMIT")))
+    commits = sum(1 for st in statements if st.strip().upper().startswith("COMMIT"))
+    print(
+        f"после: store.session(): {len(statements) / n:.1f} SQL (из них {writes / n:.1f} записей), "
+        f"{commits / n:.1f} коммитов, {appends[0] / n:.1f} дозаписей журнала, {us:.0f} мкс на сообщение"
+    )
+    storage.close_db()
+
+
+# ------------- messages: журнал msglog.py против таблицы user_messages -------------
+
+def cmd_messages(args) -> None:
+    from pathlib import Path
+    from msglog import MessageLog
+
+    tmp = tempfile.mkdtemp(prefix="astrobot-bench-")
+    users = range(args.users)
+    n = args.users * args.per_user
+    text = "♌ Лев\nСезон: осень\n\n" + "Звёзды советуют не спешить. " * 6
+
+    def rate(title: str, count: int, fn) -> None:
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        print(f"{title}: {count / dt:,.0f} оп/с ({dt:.2f}s на {count})")
+
+    # «до»: как store.py до журнала — строка user_messages на сообщение,
+    # очистка месяца — DELETE по каждому пользователю
+    conn = sqlite3.connect(os.path.join(tmp, "messages.db"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE user_messages (user_id INTEGER NOT NULL, seq INTEGER NOT NULL, "
+        "ts TEXT, text TEXT, PRIMARY KEY (user_id, seq))"
+    )
+
+    def sql_append() -> None:
+        for seq in range(args.per_user):
+            for uid in users:
+                conn.execute(
+                    "INSERT INTO user_messages (user_id, seq, ts, text) VALUES (?, ?, ?, ?)",
+                    (uid, seq, "2026-10-18T09:00:00", text),
+                )
+                conn.commit()
+
+    def sql_read() -> None:
+        for uid in users:
+            conn.execute("SELECT ts, text FROM user_messages WHERE user_id=? ORDER BY seq", (uid,)).fetchall()
+
+    def sql_reset() -> None:
+        for uid in users:
+            conn.execute("DELETE FROM user_messages WHERE user_id=?", (uid,))
+            conn.commit()
+
+    rate("до: дописать сообщение (user_messages)", n, sql_append)
+    rate("до: история пользователя", args.users, sql_read)
+    rate("до: новый месяц (DELETE по пользователям)", args.users, sql_reset)
+    conn.close()
+
+    october = 1792224000  # 2026-10-17 UTC
+    log = MessageLog(Path(tmp) / "messages", limit=500)
+
+    def log_append() -> None:
+        for _ in range(args.per_user):
+            for uid in users:
+                log.append(uid, text, ts=october)
+
+    rate("после: дописать сообщение (msglog)", n, log_append)
+    rate("после: история пользователя", args.users, lambda: [log.read(uid) for uid in users])
+    t0 = time.perf_counter()
+    log.append(0, text, ts=october + 31 * 86400)
+    print(f"после: новый месяц (смена файла): {(time.perf_counter() - t0) * 1000:.1f}ms")
+    log.close()
+    t0 = time.perf_counter()
+    reopened = MessageLog(Path(tmp) / "messages", limit=500)
+    reopened.read(0, month="2026-10")
+    print(f"после: открыть сегмент на {n} записей: {(time.perf_counter() - t0) * 1000:.1f}ms")
+    reopened.close()
+
+
+# --------------- history: окна в памяти + журнал против JSON целиком ---------------
+
+def _legacy_history(path: str):
+    """Как было в history.py: каждый вызов читает и переписывает весь JSON."""
+    import datetime
+
+    def load() -> dict:
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(data: dict) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def recent(sign: str, days: int = 14) -> set:
+        data = load()
+        cutoff = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+        records = data.get(sign, [])
+        keep = [r for r in records if r.get("date", "") >= cutoff]
+        if len(keep) != len(records):
+            data[sign] = keep
+            save(data)
+        return {r.get("id") for r in keep}
+
+    def remember(sign: str, template_id: str) -> None:
+        data = load()
+        records = data.get(sign, [])
+        records.append({"id": str(template_id), "date": datetime.date.today().isoformat()})
+        data[sign] = records[-50:]
+        save(data)
+
+    return recent, remember
+
+
+def cmd_history(args) -> None:
+    from pathlib import Path
+    from content import ZODIAC
+    from history import TemplateHistory
+
+    tmp = tempfile.mkdtemp(prefix="astrobot-bench-")
+    signs = list(ZODIAC.values())
+    n = args.count
+
+    def rate(title: str, fn) -> None:
+        t0 = time.perf_counter()
+        for i in range(n):
+            fn(signs[i % len(signs)], f"tpl_{i % 300}")
+        dt = time.perf_counter() - t0
+        print(f"{title}: {n / dt:,.0f} оп/с ({dt:.2f}s на {n})")
+
+    recent, remember = _legacy_history(os.path.join(tmp, "history.json"))
+    rate("до: remember_template_id", remember)
+    rate("до: get_recent_template_ids", lambda sign, _: recent(sign))
+
+    history = TemplateHistory(Path(tmp) / "history.log")
+    rate("после: remember_template_id", history.remember)
+    rate("после: get_recent_template_ids", lambda sign, _: history.recent(sign))
+    history.close()
+    lines = sum(1 for _ in open(Path(tmp) / "history.log", encoding="utf-8"))
+    print(f"после: строк в журнале после сжатия: {lines}")
+
+
+# ---------------------- ai: ai_client против заглушки API ----------------------
+# Заглушка отвечает на /v1/chat/completions с заданной задержкой и долей
+# ошибок 500 — видно, как работают дедлайн, лимит параллелизма и размыкатель.
+
+async def _bench_ai(args) -> None:
+    import random
+    from aiohttp import web
+
+    rng = random.Random(args.seed)
+    inflight = {"now": 0, "max": 0}
+
+    async def completions(request: web.Request) -> web.Response:
+        inflight["now"] += 1
+        inflight["max"] = max(inflight["max"], inflight["now"])
+        try:
+            await asyncio.sleep(args.latency * (0.5 + rng.random()))
+            if rng.random() < args.error_rate:
+                return web.json_response({"error": {"message": "stub failure"}}, status=500)
+            return web.json_response(
+                {
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": "Тихий день — Заглушка"},
+                        }
+                    ],
+                }
+            )
+        finally:
+            inflight["now"] -= 1
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["AI_DEADLINE"] = str(args.deadline)
+    os.environ["AI_CONCURRENCY"] = str(args.concurrency)
+    os.environ["AI_CACHE_FILE"] = ""
+    from ai_client import get_ai_client
+    from ai_gen import ai_horoscope, ai_cache
+
+    client = get_ai_client()
+    samples: List[float] = []
+    messages = [{"role": "user", "content": "bench"}]
+
+    async def one() -> None:
+        t0 = time.perf_counter()
+        await client.complete(messages, fallback=lambda: "шаблон")
+        samples.append(time.perf_counter() - t0)
+
+    for _ in range(args.rounds):
+        await asyncio.gather(*(one() for _ in range(args.count)))
+        print(f"цепь: {client.breaker.state}, {client.stats}")
+
+    _report("complete", samples)
+    print(f"одновременно в заглушке: максимум {inflight['max']} (лимит {args.concurrency})")
+
+    # всплеск одинаковых запросов: один вызов модели на (знак, язык, день)
+    signs = ["Овен", "Телец", "Близнецы"]
+    await asyncio.gather(*(ai_horoscope(signs[i % len(signs)]) for i in range(args.count * 4)))
+    print(f"кеш ai_horoscope: {ai_cache.stats}, hit rate {ai_cache.hit_rate():.1%}")
+    await client.close()
+    await runner.cleanup()
+
+
+def cmd_ai(args) -> None:
+    asyncio.run(_bench_ai(args))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки AstroBot")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("updates", help="задержка обработки апдейтов: polling vs webhook")
+    p.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    p.add_argument("--updates", default="", help="JSONL с записанными апдейтами")
+    p.add_argument("--count", type=int, default=200)
+    p.add_argument("--api-port", type=int, default=8081)
+    p.add_argument("--webhook-url", default="http://127.0.0.1:8080/telegram/webhook")
+    p.add_argument("--warmup", type=float, default=3.0, help="сек на запуск бота")
+    p.set_defaults(func=cmd_updates)
+
+    p = sub.add_parser("router", help="разбор текста кнопок: ROUTES vs lambda-фильтры")
+    p.add_argument("--number", type=int, default=2000)
+    p.set_defaults(func=cmd_router)
+
+    p = sub.add_parser("storage", help="storage.py: операций в секунду до/после")
+    p.add_argument("--count", type=int, default=2000)
+    p.set_defaults(func=cmd_storage)
+
+    p = sub.add_parser("store", help="logic.generate_message: ввод-вывод до (storage.json) и после (store.session())")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=cmd_store)
+
+    p = sub.add_parser("messages", help="журнал сообщений: msglog.py против user_messages")
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--per-user", type=int, default=30)
+    p.set_defaults(func=cmd_messages)
+
+    p = sub.add_parser("history", help="history.py: операций в секунду до/после")
+    p.add_argument("--count", type=int, default=3000)
+    p.set_defaults(func=cmd_history)
+
+    p = sub.add_parser("ai", help="ai_client.py: дедлайн, лимит и размыкатель на заглушке")
+    p.add_argument("--count", type=int, default=50, help="запросов за раунд")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--latency", type=float, default=0.2, help="средняя задержка заглушки, сек")
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--deadline", type=float, default=1.0)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--port", type=int, default=8082)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_ai)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,26 +1,71 @@
 import os
 import json
 import logging
+import time
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta, time as dtime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
 
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils import executor
+from aiogram.utils.exceptions import BadRequest
 
 from generator import (
     generate,
+    generate_many,
+    SUPPORTED_LANGS,
     draw_tarot_for_user,
+    warm_render_cache,
+    render_cache_stats,
     ZODIAC_SIGNS,
     SIGN_NAMES,
     TZ,
 )
+from user_repo import UserRepository, atomic_write_text
+from settings import (
+    BOT_MODE,
+    HOST,
+    PORT,
+    WEBHOOK_PATH,
+    PUBLIC_URL,
+    TELEGRAM_API_URL,
+)
+from broadcast import Broadcaster
+from scheduler import ReminderScheduler
+from outbox import Outbox
+from quotes import pregenerate_daily_quotes
+from ai_client import close_ai_client
+from ai_gen import ai_cache
+import storage
 
 BASE_DIR = Path(__file__).parent
 USERS_FILE = BASE_DIR / "users_state.json"
 TAROT_IMAGES_DIR = BASE_DIR / "tarot_images"
+# file_id, которые Telegram вернул после первой загрузки каждой карты
+TAROT_FILE_IDS_FILE = BASE_DIR / "tarot_file_ids.json"
+
+# Как часто (сек) и какими пачками сбрасывать изменения пользователей на диск
+USERS_FLUSH_INTERVAL = float(os.getenv("USERS_FLUSH_INTERVAL", "5"))
+USERS_FLUSH_BATCH = int(os.getenv("USERS_FLUSH_BATCH", "500"))
+
+# Ограничения ежедневной рассылки (Telegram: ~30 msg/s на бота, ~1 msg/s на чат)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+# Сколько сообщений outbox переводит в «отправляется» одной транзакцией
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "500"))
+
+# Сколько минут после пропущенного (бот лежал) напоминания его ещё досылать
+REMINDER_GRACE_MINUTES = float(os.getenv("REMINDER_GRACE_MINUTES", "60"))
+
+# Прогревать кеш гороскопов в полночь по TZ (0 — только лениво, по запросу)
+PREWARM_AT_MIDNIGHT = os.getenv("PREWARM_AT_MIDNIGHT", "1") == "1"
+# Создавать цитаты дня для всех знаков в полночь (и при старте), а не по первому запросу
+PREGENERATE_QUOTES = os.getenv("PREGENERATE_QUOTES", "1") == "1"
+QUOTES_CONCURRENCY = int(os.getenv("QUOTES_CONCURRENCY", "4"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,9 +83,28 @@ ADMIN_IDS = {
     # можно добавить ещё id через запятую
 }
 
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+if TELEGRAM_API_URL:
+    bot = Bot(
+        token=BOT_TOKEN,
+        parse_mode="HTML",
+        server=TelegramAPIServer.from_base(TELEGRAM_API_URL),
+    )
+else:
+    bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
 dp = Dispatcher(bot)
 
+users_repo = UserRepository(
+    USERS_FILE,
+    flush_interval=USERS_FLUSH_INTERVAL,
+    batch_size=USERS_FLUSH_BATCH,
+)
+broadcaster = Broadcaster(
+    bot,
+    rate=BROADCAST_RATE,
+    concurrency=BROADCAST_CONCURRENCY,
+    per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+)
+
 UI = {
     "ru": {
         "choose_lang": "Выберите язык:",
@@ -134,17 +198,6 @@ UI = {
     },
 }
 
-CANCEL_BUTTONS = {
-    UI["ru"]["btn_cancel_reminders"],
-    UI["en"]["btn_cancel_reminders"],
-    UI["es"]["btn_cancel_reminders"],
-}
-BACK_BUTTONS = {
-    UI["ru"]["btn_back"],
-    UI["en"]["btn_back"],
-    UI["es"]["btn_back"],
-}
-
 SIGN_EMOJIS = {
     "Овен": "🐏",
     "Телец": "🐂",
@@ -164,37 +217,18 @@ SIGN_EMOJIS = {
 
 
 def load_users() -> Dict[str, Any]:
-    if not USERS_FILE.exists():
-        return {}
-    try:
-        with USERS_FILE.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка чтения {USERS_FILE}: {e}")
-        return {}
-
-
-def save_users(data: Dict[str, Any]) -> None:
-    try:
-        USERS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with USERS_FILE.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Ошибка записи {USERS_FILE}: {e}")
+    return users_repo.all()
 
 
 def get_user(chat_id: int) -> Dict[str, Any]:
-    users = load_users()
-    return users.get(str(chat_id), {})
+    return users_repo.get(chat_id)
 
 
 def update_user(chat_id: int, **kwargs) -> Dict[str, Any]:
-    users = load_users()
-    u = users.get(str(chat_id), {})
-    u.update(kwargs)
-    users[str(chat_id)] = u
-    save_users(users)
-    return u
+    user = users_repo.update(chat_id, **kwargs)
+    if "reminder_time" in kwargs:
+        reminder_scheduler.schedule(chat_id, user)
+    return user
 
 
 def get_user_lang(chat_id: int) -> str:
@@ -204,10 +238,76 @@ def get_user_lang(chat_id: int) -> str:
         lang = "ru"
     return lang
 
+# ------------------------- Картинки карт Таро -----------------------
+
+tarot_file_ids: Dict[str, str] = {}
+
+
+def load_tarot_file_ids() -> None:
+    if not TAROT_FILE_IDS_FILE.exists():
+        return
+    try:
+        with TAROT_FILE_IDS_FILE.open("r", encoding="utf-8") as f:
+            tarot_file_ids.update(json.load(f))
+    except Exception as e:
+        logger.error(f"Ошибка чтения {TAROT_FILE_IDS_FILE}: {e}")
+
+
+def save_tarot_file_ids() -> None:
+    try:
+        atomic_write_text(
+            TAROT_FILE_IDS_FILE,
+            json.dumps(tarot_file_ids, ensure_ascii=False, indent=2),
+        )
+    except Exception as e:
+        logger.error(f"Ошибка записи {TAROT_FILE_IDS_FILE}: {e}")
+
+
+async def send_tarot_photo(chat_id: int, image_name: str, image_path: Path, **kwargs):
+    """
+    Шлём картинку карты по сохранённому file_id, а если его ещё нет
+    или Telegram его не принял — загружаем файл и запоминаем новый id.
+    """
+    file_id = tarot_file_ids.get(image_name)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"file_id для {image_name} отклонён ({e}), загружаем заново")
+            tarot_file_ids.pop(image_name, None)
+
+    msg = await bot.send_photo(chat_id, photo=types.InputFile(image_path), **kwargs)
+    if msg.photo:
+        tarot_file_ids[image_name] = msg.photo[-1].file_id
+        save_tarot_file_ids()
+    return msg
+
 # ----------------------------- Клавиатуры ---------------------------
 
 
-def build_lang_keyboard() -> ReplyKeyboardMarkup:
+# Все клавиатуры строятся один раз при старте и хранятся уже в виде JSON:
+# aiogram передаёт строковый reply_markup в Bot API как есть, без повторной
+# сериализации. Вариантов немного: 12 знаков × 3 языка.
+
+
+def _sign_button_text(sign: str, lang: str) -> str:
+    local = SIGN_NAMES.get(lang, SIGN_NAMES["ru"]).get(sign, sign)
+    emoji = SIGN_EMOJIS.get(sign, "⭐️")
+    return f"{emoji} {local}"
+
+
+def _horoscope_button_text(sign: str, lang: str) -> str:
+    emoji = SIGN_EMOJIS.get(sign, "⭐️")
+    local_name = SIGN_NAMES.get(lang, SIGN_NAMES["ru"]).get(sign, sign)
+    if lang == "ru":
+        return f"{emoji} {local_name} — гороскоп на сегодня"
+    elif lang == "en":
+        return f"{emoji} {local_name} — horoscope for today"
+    else:
+        return f"{emoji} {local_name} — horóscopo para hoy"
+
+
+def _make_lang_keyboard() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     kb.row(
         KeyboardButton(UI["ru"]["btn_lang_ru"]),
@@ -217,12 +317,10 @@ def build_lang_keyboard() -> ReplyKeyboardMarkup:
     return kb
 
 
-def build_sign_keyboard(lang: str) -> ReplyKeyboardMarkup:
+def _make_sign_keyboard(lang: str) -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
     for i, sign in enumerate(ZODIAC_SIGNS):
-        local = SIGN_NAMES.get(lang, SIGN_NAMES["ru"]).get(sign, sign)
-        emoji = SIGN_EMOJIS.get(sign, "⭐️")
-        btn_text = f"{emoji} {local}"
+        btn_text = _sign_button_text(sign, lang)
         if i % 2 == 0:
             kb.row(KeyboardButton(btn_text))
         else:
@@ -230,18 +328,10 @@ def build_sign_keyboard(lang: str) -> ReplyKeyboardMarkup:
     return kb
 
 
-def build_main_keyboard(sign: str, lang: str) -> ReplyKeyboardMarkup:
+def _make_main_keyboard(sign: str, lang: str) -> ReplyKeyboardMarkup:
     ui = UI[lang]
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    emoji = SIGN_EMOJIS.get(sign, "⭐️")
-    local_name = SIGN_NAMES.get(lang, SIGN_NAMES["ru"]).get(sign, sign)
-    if lang == "ru":
-        title = f"{emoji} {local_name} — гороскоп на сегодня"
-    elif lang == "en":
-        title = f"{emoji} {local_name} — horoscope for today"
-    else:
-        title = f"{emoji} {local_name} — horóscopo para hoy"
-    kb.row(KeyboardButton(title))
+    kb.row(KeyboardButton(_horoscope_button_text(sign, lang)))
     kb.row(KeyboardButton(ui["btn_tarot"]))
     kb.row(KeyboardButton(ui["btn_reminder"]))
     kb.row(KeyboardButton(ui["btn_change_sign"]))
@@ -249,8 +339,7 @@ def build_main_keyboard(sign: str, lang: str) -> ReplyKeyboardMarkup:
     return kb
 
 
-def build_time_keyboard(lang: str) -> ReplyKeyboardMarkup:
-    ui = UI[lang]
+def _make_time_keyboard(lang: str) -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardMarkup(resize_keyboard=True)
 
     # единый набор времени для всех языков, без дублей
@@ -262,9 +351,45 @@ def build_time_keyboard(lang: str) -> ReplyKeyboardMarkup:
     kb.row(KeyboardButton(UI[lang]["btn_back"]))
     return kb
 
+
+LANG_KEYBOARD = _make_lang_keyboard().as_json()
+SIGN_KEYBOARDS = {lang: _make_sign_keyboard(lang).as_json() for lang in UI}
+TIME_KEYBOARDS = {lang: _make_time_keyboard(lang).as_json() for lang in UI}
+MAIN_KEYBOARDS = {
+    (sign, lang): _make_main_keyboard(sign, lang).as_json()
+    for sign in ZODIAC_SIGNS
+    for lang in UI
+}
+
+
+def build_lang_keyboard() -> str:
+    return LANG_KEYBOARD
+
+
+def build_sign_keyboard(lang: str) -> str:
+    return SIGN_KEYBOARDS.get(lang) or SIGN_KEYBOARDS["ru"]
+
+
+def build_main_keyboard(sign: str, lang: str) -> str:
+    kb = MAIN_KEYBOARDS.get((sign, lang))
+    if kb is None:
+        # знак вне ZODIAC_SIGNS (старые записи) — строим на лету
+        kb = _make_main_keyboard(sign, lang if lang in UI else "ru").as_json()
+    return kb
+
+
+def build_time_keyboard(lang: str) -> str:
+    return TIME_KEYBOARDS.get(lang) or TIME_KEYBOARDS["ru"]
+
 # ----------------------------- Хэндлеры -----------------------------
 
 
+class Route(NamedTuple):
+    handler: Callable[..., Awaitable[Any]]
+    lang: str
+    payload: Optional[str] = None
+
+
 @dp.message_handler(commands=["start"])
 async def cmd_start(message: types.Message):
     user = get_user(message.chat.id)
@@ -346,22 +471,8 @@ async def cmd_stats(message: types.Message):
     await message.answer("\n".join(lines))
 
 
-@dp.message_handler(
-    lambda m: m.text
-    in {
-        UI["ru"]["btn_lang_ru"],
-        UI["ru"]["btn_lang_en"],
-        UI["ru"]["btn_lang_es"],
-    }
-)
-async def handle_lang_choice(message: types.Message):
-    text = message.text
-    if text == UI["ru"]["btn_lang_ru"]:
-        lang = "ru"
-    elif text == UI["ru"]["btn_lang_en"]:
-        lang = "en"
-    else:
-        lang = "es"
+async def handle_lang_choice(message: types.Message, route: Route):
+    lang = route.payload
 
     user = update_user(message.chat.id, lang=lang)
     ui = UI[lang]
@@ -380,43 +491,17 @@ async def handle_lang_choice(message: types.Message):
         await message.answer(ui["start_no_sign"], reply_markup=build_sign_keyboard(lang))
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and (
-        m.text == UI["ru"]["btn_change_lang"]
-        or m.text == UI["en"]["btn_change_lang"]
-        or m.text == UI["es"]["btn_change_lang"]
-    )
-)
-async def handle_change_language(message: types.Message):
+async def handle_change_language(message: types.Message, route: Route):
     lang = get_user_lang(message.chat.id)
     ui = UI[lang]
     await message.answer(ui["choose_lang"], reply_markup=build_lang_keyboard())
 
 
-# выбор знака – только кнопки вида "🐏 Aries", без "—"
-@dp.message_handler(
-    lambda m: m.text
-    and m.text.startswith(tuple(SIGN_EMOJIS.values()))
-    and "—" not in m.text
-)
-async def handle_sign_choice(message: types.Message):
+async def handle_sign_choice(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
-
-    parts = message.text.split(" ", 1)
-    if len(parts) < 2:
-        return
-    label = parts[1].strip()
-
-    base_sign = None
-    for s in ZODIAC_SIGNS:
-        if SIGN_NAMES.get(lang, SIGN_NAMES["ru"]).get(s, s) == label:
-            base_sign = s
-            break
-
-    if not base_sign:
-        return
+    base_sign = route.payload
+    label = SIGN_NAMES[lang].get(base_sign, base_sign)
 
     update_user(chat_id, sign=base_sign)
     await message.answer(
@@ -427,28 +512,7 @@ async def handle_sign_choice(message: types.Message):
     )
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and any(
-        m.text.startswith(prefix)
-        for prefix in [
-            "🐏",
-            "🐂",
-            "👥",
-            "🦀",
-            "🦁",
-            "👩‍🦰",
-            "⚖️",
-            "🦂",
-            "🏹",
-            "🐐",
-            "🌊",
-            "🐟",
-        ]
-    )
-    and "—" in m.text
-)
-async def handle_horoscope_request(message: types.Message):
+async def handle_horoscope_request(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     user = get_user(chat_id)
@@ -469,23 +533,13 @@ async def handle_horoscope_request(message: types.Message):
     await message.answer(text, reply_markup=build_main_keyboard(sign, lang))
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and m.text
-    in {UI["ru"]["btn_change_sign"], UI["en"]["btn_change_sign"], UI["es"]["btn_change_sign"]}
-)
-async def handle_change_sign(message: types.Message):
+async def handle_change_sign(message: types.Message, route: Route):
     lang = get_user_lang(message.chat.id)
     ui = UI[lang]
     await message.answer(ui["start_no_sign"], reply_markup=build_sign_keyboard(lang))
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and m.text
-    in {UI["ru"]["btn_tarot"], UI["en"]["btn_tarot"], UI["es"]["btn_tarot"]}
-)
-async def handle_tarot(message: types.Message):
+async def handle_tarot(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     result = draw_tarot_for_user(chat_id, lang)
@@ -493,6 +547,7 @@ async def handle_tarot(message: types.Message):
     user = get_user(chat_id)
     sign = user.get("sign", ZODIAC_SIGNS[0])
 
+    image_name = None
     image_path = None
     text = ""
 
@@ -506,16 +561,17 @@ async def handle_tarot(message: types.Message):
         )
         if image_name:
             candidate = TAROT_IMAGES_DIR / image_name
-            if candidate.exists():
+            if image_name in tarot_file_ids or candidate.exists():
                 image_path = candidate
     else:
         text = str(result)
 
     if image_path is not None:
         try:
-            await bot.send_photo(
+            await send_tarot_photo(
                 chat_id,
-                photo=types.InputFile(image_path),
+                image_name,
+                image_path,
                 caption=text or None,
                 reply_markup=build_main_keyboard(sign, lang),
             )
@@ -526,24 +582,14 @@ async def handle_tarot(message: types.Message):
     await message.answer(text, reply_markup=build_main_keyboard(sign, lang))
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and m.text
-    in {
-        UI["ru"]["btn_reminder"],
-        UI["en"]["btn_reminder"],
-        UI["es"]["btn_reminder"],
-    }
-)
-async def handle_reminder_button(message: types.Message):
+async def handle_reminder_button(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     ui = UI[lang]
     await message.answer(ui["reminder_prompt"], reply_markup=build_time_keyboard(lang))
 
 
-@dp.message_handler(lambda m: m.text in CANCEL_BUTTONS)
-async def handle_cancel_reminders(message: types.Message):
+async def handle_cancel_reminders(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     ui = UI[lang]
@@ -555,8 +601,7 @@ async def handle_cancel_reminders(message: types.Message):
     )
 
 
-@dp.message_handler(lambda m: m.text in BACK_BUTTONS)
-async def handle_back(message: types.Message):
+async def handle_back(message: types.Message, route: Route):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     ui = UI[lang]
@@ -571,12 +616,6 @@ async def handle_back(message: types.Message):
     )
 
 
-@dp.message_handler(
-    lambda m: m.text
-    and ":" in m.text
-    and len(m.text) in (4, 5)
-    and m.text.replace(":", "").isdigit()
-)
 async def handle_time_input(message: types.Message):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
@@ -608,7 +647,6 @@ async def handle_time_input(message: types.Message):
     )
 
 
-@dp.message_handler()
 async def fallback_handler(message: types.Message):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
@@ -621,33 +659,180 @@ async def fallback_handler(message: types.Message):
         kb = build_sign_keyboard(lang)
     await message.answer(ui["unknown"], reply_markup=kb)
 
+# ------------------------ Маршрутизация кнопок ----------------------
+# Вместо цепочки lambda-фильтров — одна таблица «точный текст кнопки ->
+# (хэндлер, язык кнопки, знак/полезная нагрузка)», собранная из UI,
+# SIGN_NAMES и SIGN_EMOJIS. Разбор входящего текста — один поиск в dict.
+
+
+def _build_routes() -> Dict[str, Route]:
+    routes: Dict[str, Route] = {}
+    for lang, ui in UI.items():
+        routes[ui["btn_change_lang"]] = Route(handle_change_language, lang)
+        routes[ui["btn_change_sign"]] = Route(handle_change_sign, lang)
+        routes[ui["btn_tarot"]] = Route(handle_tarot, lang)
+        routes[ui["btn_reminder"]] = Route(handle_reminder_button, lang)
+        routes[ui["btn_cancel_reminders"]] = Route(handle_cancel_reminders, lang)
+        routes[ui["btn_back"]] = Route(handle_back, lang)
+        for sign in ZODIAC_SIGNS:
+            # "Aries"/"Leo"/... совпадают в en и es — знак при этом один и тот же
+            routes.setdefault(
+                _sign_button_text(sign, lang), Route(handle_sign_choice, lang, sign)
+            )
+            routes[_horoscope_button_text(sign, lang)] = Route(
+                handle_horoscope_request, lang, sign
+            )
+    for code in ("ru", "en", "es"):
+        routes[UI["ru"][f"btn_lang_{code}"]] = Route(handle_lang_choice, code, code)
+    return routes
+
+
+ROUTES = _build_routes()
+
+
+def _is_time_text(text: str) -> bool:
+    return ":" in text and len(text) in (4, 5) and text.replace(":", "").isdigit()
+
+
+@dp.message_handler()
+async def route_message(message: types.Message):
+    text = message.text or ""
+    route = ROUTES.get(text)
+    if route is not None:
+        await route.handler(message, route)
+    elif _is_time_text(text):
+        await handle_time_input(message)
+    else:
+        await fallback_handler(message)
+
 # --------------------- Ежедневные напоминания ----------------------
 
 
-async def send_daily_horoscopes():
-    while True:
-        now = datetime.now(TZ)
-        current_time = now.strftime("%H:%M")
-        users = load_users()
+def _daily_messages(due):
+    due = [(chat_id_str, data) for chat_id_str, data in due if data.get("sign")]
+    try:
+        texts = generate_many(
+            {data["sign"] for _, data in due},
+            {data.get("lang", "ru") for _, data in due},
+        )
+    except Exception as e:
+        logger.error(f"Ошибка generate_many() для рассылки: {e}")
+        return
+    for chat_id_str, data in due:
+        lang = data.get("lang", "ru")
+        text = texts.get((data["sign"], lang if lang in SUPPORTED_LANGS else "ru"))
+        if text is None:
+            logger.error(f"Нет текста гороскопа для {chat_id_str}: {data['sign']}/{lang}")
+            continue
+        yield int(chat_id_str), text
+
+
+daily_outbox = Outbox(broadcaster, kind="daily", batch_size=OUTBOX_BATCH)
+
+
+def _today() -> str:
+    return datetime.now(TZ).date().isoformat()
+
+
+def _on_reminders_due(due):
+    # метка нужна планировщику, чтобы после рестарта не слать повторно
+    sent_at = int(time.time())
+    for chat_id_str, _ in due:
+        users_repo.update(int(chat_id_str), reminder_sent_at=sent_at)
+    # сначала фиксируем в outbox, отправка идёт отдельной задачей
+    added = daily_outbox.enqueue(_today(), _daily_messages(due))
+    if added < len(due):
+        logger.info(f"Рассылка гороскопов: {len(due) - added} уже в outbox на сегодня, пропускаем")
+
+
+reminder_scheduler = ReminderScheduler(
+    users_repo.all,
+    _on_reminders_due,
+    TZ,
+    grace=REMINDER_GRACE_MINUTES * 60,
+)
+
 
-        for chat_id_str, data in users.items():
-            reminder_time = data.get("reminder_time")
-            sign = data.get("sign")
-            lang = data.get("lang", "ru")
-            if reminder_time == current_time and sign:
-                try:
-                    text = generate(sign, lang)
-                    await bot.send_message(int(chat_id_str), text)
-                except Exception as e:
-                    logger.error(f"Ошибка отправки сообщения {chat_id_str}: {e}")
+def _seconds_until_midnight() -> float:
+    now = datetime.now(TZ)
+    midnight = TZ.localize(datetime.combine(now.date() + timedelta(days=1), dtime()))
+    return max(0.0, (midnight - now).total_seconds())
 
-        await asyncio.sleep(60)
+
+async def pregenerate_quotes():
+    try:
+        stats = await pregenerate_daily_quotes(concurrency=QUOTES_CONCURRENCY)
+        logger.info(f"Цитаты дня готовы: {stats}")
+    except Exception as e:
+        logger.error(f"Ошибка предгенерации цитат: {e}")
+
+
+async def prewarm_at_midnight():
+    while True:
+        await asyncio.sleep(_seconds_until_midnight() + 1)
+        if PREWARM_AT_MIDNIGHT:
+            try:
+                warm_render_cache()
+                logger.info(f"Кеш гороскопов прогрет: {render_cache_stats()}")
+            except Exception as e:
+                logger.error(f"Ошибка прогрева кеша гороскопов: {e}")
+        if PREGENERATE_QUOTES:
+            await pregenerate_quotes()
 
 
 async def on_startup(dp: Dispatcher):
-    asyncio.create_task(send_daily_horoscopes())
+    users_repo.load()
+    users_repo.start()
+    load_tarot_file_ids()
+    storage.init_db()
+    daily_outbox.resume(_today())
+    reminder_scheduler.start()
+    if PREWARM_AT_MIDNIGHT or PREGENERATE_QUOTES:
+        asyncio.create_task(prewarm_at_midnight())
+    if PREGENERATE_QUOTES:
+        # день мог начаться, пока бот лежал
+        asyncio.create_task(pregenerate_quotes())
     logger.info("Бот запущен и отправка напоминаний активирована.")
 
 
+async def on_shutdown(dp: Dispatcher):
+    await reminder_scheduler.close()
+    await daily_outbox.close()
+    await close_ai_client()
+    await ai_cache.flush()
+    storage.close_db()
+    await users_repo.close()
+    logger.info("Состояние пользователей сохранено.")
+
+
+async def on_startup_webhook(dp: Dispatcher):
+    # без PUBLIC_URL вебхук не регистрируем — удобно для локальной проверки,
+    # когда апдейты постятся прямо в WEBHOOK_PATH
+    if PUBLIC_URL:
+        await bot.set_webhook(PUBLIC_URL + WEBHOOK_PATH, drop_pending_updates=True)
+        logger.info(f"Вебхук зарегистрирован: {PUBLIC_URL}{WEBHOOK_PATH}")
+    else:
+        logger.warning("PUBLIC_URL не задан, вебхук в Telegram не регистрируется.")
+    await on_startup(dp)
+
+
+async def on_shutdown_webhook(dp: Dispatcher):
+    if PUBLIC_URL:
+        await bot.delete_webhook()
+    await on_shutdown(dp)
+
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if BOT_MODE == "webhook":
+        executor.start_webhook(
+            dispatcher=dp,
+            webhook_path=WEBHOOK_PATH,
+            on_startup=on_startup_webhook,
+            on_shutdown=on_shutdown_webhook,
+            host=HOST,
+            port=PORT,
+        )
+    else:
+        executor.start_polling(
+            dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown
+        )
@@ -0,0 +1,174 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    RetryAfter,
+    BotBlocked,
+    ChatNotFound,
+    UserDeactivated,
+    NetworkError,
+    TelegramAPIError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Глобальный лимит сообщений в секунду (у Telegram ~30 msg/s на бота).
+    pause() замораживает выдачу токенов — так отрабатываем RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    throttled: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"sent={self.sent} failed={self.failed} "
+            f"throttled={self.throttled} time={self.elapsed:.1f}s"
+        )
+
+
+class Broadcaster:
+    """
+    Параллельная рассылка с ограничениями:
+    - concurrency одновременных запросов к Bot API;
+    - общий token bucket на rate сообщений в секунду;
+    - не чаще одного сообщения в per_chat_interval секунд в один чат;
+    - RetryAfter: ставим всю рассылку на паузу и повторяем то же сообщение.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float = 30,
+        concurrency: int = 20,
+        per_chat_interval: float = 1.0,
+        network_retries: int = 3,
+    ):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.network_retries = network_retries
+
+    async def _wait_chat_slot(self, chat_id: int, last_sent: Dict[int, float]) -> None:
+        last = last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        last_sent[chat_id] = time.monotonic()
+
+    async def _send_one(
+        self, chat_id: int, text: str, stats: BroadcastStats, last_sent: Dict[int, float]
+    ) -> bool:
+        network_attempts = 0
+        while True:
+            await self._wait_chat_slot(chat_id, last_sent)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                stats.sent += 1
+                return True
+            except RetryAfter as e:
+                stats.throttled += 1
+                logger.warning(f"RetryAfter {e.timeout}s при отправке в {chat_id}")
+                self.bucket.pause(e.timeout)
+            except (BotBlocked, ChatNotFound, UserDeactivated) as e:
+                stats.failed += 1
+                logger.info(f"Чат {chat_id} недоступен: {e}")
+                return False
+            except NetworkError as e:
+                network_attempts += 1
+                if network_attempts > self.network_retries:
+                    stats.failed += 1
+                    logger.error(f"Сеть: не удалось отправить {chat_id}: {e}")
+                    return False
+                await asyncio.sleep(network_attempts)
+            except TelegramAPIError as e:
+                stats.failed += 1
+                logger.error(f"Ошибка отправки сообщения {chat_id}: {e}")
+                return False
+
+    async def run(
+        self,
+        messages: Iterable[Tuple[int, str]],
+        on_result: Optional[Callable[[int, bool], None]] = None,
+    ) -> BroadcastStats:
+        """
+        Отправить все (chat_id, text) и вернуть счётчики прогона.
+        on_result(chat_id, ok) вызывается по каждому сообщению.
+        """
+        stats = BroadcastStats()
+        last_sent: Dict[int, float] = {}
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        return
+                    try:
+                        ok = await self._send_one(item[0], item[1], stats, last_sent)
+                    except Exception as e:
+                        ok = False
+                        stats.failed += 1
+                        logger.error(f"Ошибка отправки сообщения {item[0]}: {e}")
+                    if on_result is not None:
+                        on_result(item[0], ok)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            for item in messages:
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+        stats.elapsed = time.monotonic() - started
+        return stats
@@ -0,0 +1,3 @@
+# test_inline.py — ручной бот для проверки inline-кнопок, а не тесты:
+# при импорте он создаёт Bot и требует BOT_TOKEN
+collect_ignore = ["test_inline.py"]
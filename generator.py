@@ -1,11 +1,13 @@
-import json
 import random
 from datetime import datetime, date
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
 import pytz
 
+from journal import JournaledState
+from horo_calendar import HoroscopeCalendar, calendar_path, pool_signature
+
 BASE_DIR = Path(__file__).parent
 ASTRO_STATE_FILE = BASE_DIR / "astro_state.json"
 
@@ -607,21 +609,21 @@ TAROT_CARDS = [
 CARD_BY_ID = {c["id"]: c for c in TAROT_CARDS}
 
 # ---------- Работа с общим состоянием (гороскопы + таро) ----------
+# Состояние живёт в памяти. astro_state.json — снимок, astro_state.journal —
+# журнал мелких изменений; смена паттерна знака или карты Таро стоит одной
+# короткой записи в журнал, а не перезаписи всего файла.
+
+_astro_state = JournaledState(ASTRO_STATE_FILE, compact_every=1000)
+
 
 def load_astro_state() -> Dict[str, Any]:
-    if not ASTRO_STATE_FILE.exists():
-        return {}
-    try:
-        with ASTRO_STATE_FILE.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    """Текущее состояние (живой словарь — менять только через журнал)."""
+    return _astro_state.state()
 
 
 def save_astro_state(state: Dict[str, Any]) -> None:
-    ASTRO_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with ASTRO_STATE_FILE.open("w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    """Заменить состояние целиком (пишет новый снимок)."""
+    _astro_state.replace(state)
 
 
 def get_season(now: datetime) -> str:
@@ -751,26 +753,126 @@ def _build_horoscope_text(sign: str, lang: str, now: datetime, pattern: Dict[str
     return "\n".join(lines)
 
 
+# ---------- Кеш готовых текстов на день ----------
+# Паттерн на знак меняется раз в сутки, поэтому за день существует
+# максимум 12 знаков × 3 языка различных текстов — их и держим в памяти.
+
+_render_cache: Dict[Tuple[str, str], str] = {}
+_render_cache_date: Optional[str] = None
+_render_stats = {"hits": 0, "misses": 0}
+
+
+def render_cache_stats() -> Dict[str, int]:
+    """Счётчики попаданий/промахов кеша и текущий размер."""
+    return {**_render_stats, "size": len(_render_cache)}
+
+
+def warm_render_cache() -> None:
+    """Заполнить кеш на сегодня для всех знаков и языков."""
+    generate_many()
+
+
 def generate(sign: str, lang: str = "ru") -> str:
     """
     Генерирует гороскоп для знака на сегодня в выбранном языке.
     Один паттерн (набор индексов фраз) на знак в день,
     текст рендерится в нужном языке из этого паттерна.
+    Готовый текст кешируется до смены даты в TZ.
     """
+    global _render_cache_date
+
+    if lang not in SUPPORTED_LANGS:
+        lang = "ru"
+
     now = datetime.now(TZ)
     today_str = now.date().isoformat()
 
-    state = load_astro_state()
-    signs_state = state.setdefault("signs", {})
-    sign_state = signs_state.setdefault(sign, {})
+    if _render_cache_date != today_str:
+        _render_cache.clear()
+        _render_cache_date = today_str
+
+    key = (sign, lang)
+    text = _render_cache.get(key)
+    if text is not None:
+        _render_stats["hits"] += 1
+        return text
+
+    _render_stats["misses"] += 1
+    text = _generate_uncached(sign, lang, now)
+    _render_cache[key] = text
+    return text
+
+
+# ---------- Заранее посчитанный календарь паттернов ----------
+# horoscope_calendar_<год>.bin собирается `python horo_calendar.py --year N`.
+# Если календаря на год нет (или он собран под другие PHRASES), паттерн
+# выбирается случайно и запоминается в astro_state, как раньше.
+
+# год -> (mtime файла, календарь); файл, собранный или пересобранный
+# horo_calendar.py уже после старта, подхватывается по смене mtime
+_calendars: Dict[int, Tuple[Optional[int], Optional[HoroscopeCalendar]]] = {}
+_SIGN_INDEX = {s: i for i, s in enumerate(ZODIAC_SIGNS)}
+
+
+def _calendar(year: int) -> Optional[HoroscopeCalendar]:
+    path = calendar_path(BASE_DIR, year)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    cached = _calendars.get(year)
+    if cached is None or cached[0] != mtime:
+        cal = None
+        if mtime is not None:
+            cal = HoroscopeCalendar.open(path, pool_signature(ZODIAC_SIGNS, PHRASES, NUMBERS))
+        cached = _calendars[year] = (mtime, cal)
+    return cached[1]
+
+
+def _calendar_pattern(sign: str, day: date) -> Optional[Dict[str, Any]]:
+    cal = _calendar(day.year)
+    sign_idx = _SIGN_INDEX.get(sign)
+    if cal is None or sign_idx is None:
+        return None
+    return cal.pattern(sign_idx, day)
+
+
+def _pick_pattern(
+    sign: str, now: datetime, state: Dict[str, Any], records: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Паттерн знака на дату now: уже сохранённый в состоянии, затем календарь,
+    иначе новый случайный. Записи для журнала новых паттернов (на любую
+    дату, чтобы generate() потом выдал тот же текст) добавляются в records —
+    их применяют одной пачкой.
+
+    Сохранённый паттерн важнее календаря: календарь, появившийся или
+    пересобранный посреди дня, не меняет уже выданный сегодня гороскоп.
+    Поэтому и паттерн из календаря на сегодня запоминается в "today".
+    """
+    day_str = now.date().isoformat()
+    is_today = day_str == datetime.now(TZ).date().isoformat()
+    sign_state = state.get("signs", {}).get(sign, {})
 
     today_entry = sign_state.get("today")
-    if isinstance(today_entry, dict) and today_entry.get("date") == today_str:
+    if isinstance(today_entry, dict) and today_entry.get("date") == day_str:
         pattern = today_entry.get("pattern")
         if pattern:
-            return _build_horoscope_text(sign, lang, now, pattern)
+            return pattern
 
     history: List[Dict[str, Any]] = sign_state.get("history", [])
+    for h in reversed(history):
+        if h.get("date") == day_str and h.get("pattern"):
+            return h["pattern"]
+
+    pattern = _calendar_pattern(sign, now.date())
+    if pattern is not None:
+        if is_today:
+            records.append(
+                {"op": "set", "path": ["signs", sign, "today"], "value": {"date": day_str, "pattern": pattern}}
+            )
+        return pattern
+
     recent_patterns = [h.get("pattern") for h in history[-14:] if "pattern" in h]
 
     pattern = None
@@ -782,16 +884,67 @@ def generate(sign: str, lang: str = "ru") -> str:
     if pattern is None:
         pattern = _random_pattern(now)
 
-    sign_state["today"] = {"date": today_str, "pattern": pattern}
-    history.append({"date": today_str, "pattern": pattern})
-    sign_state["history"] = history[-60:]
-    signs_state[sign] = sign_state
-    state["signs"] = signs_state
-    save_astro_state(state)
+    entry = {"date": day_str, "pattern": pattern}
+    if is_today:
+        records.append({"op": "set", "path": ["signs", sign, "today"], "value": entry})
+    records.append(
+        {"op": "push", "path": ["signs", sign, "history"], "value": entry, "keep": 60}
+    )
+    return pattern
+
 
+def _generate_uncached(sign: str, lang: str, now: datetime) -> str:
+    records: List[Dict[str, Any]] = []
+    pattern = _pick_pattern(sign, now, load_astro_state(), records)
+    _astro_state.apply(records)
     return _build_horoscope_text(sign, lang, now, pattern)
 
 
+def generate_many(
+    signs: Optional[Iterable[str]] = None,
+    langs: Optional[Iterable[str]] = None,
+    day: Optional[date] = None,
+) -> Dict[Tuple[str, str], str]:
+    """
+    Гороскопы сразу для набора знаков и языков: {(sign, lang): text}.
+    Состояние читается один раз, недостающие паттерны дня (в том числе
+    для day не сегодня) сохраняются одной пачкой в журнал. По умолчанию —
+    все знаки и языки на сегодня.
+    """
+    global _render_cache_date
+
+    signs = list(signs) if signs is not None else ZODIAC_SIGNS
+    langs = [l if l in SUPPORTED_LANGS else "ru" for l in (langs or SUPPORTED_LANGS)]
+
+    now = datetime.now(TZ)
+    if day is not None and day != now.date():
+        now = TZ.localize(datetime(day.year, day.month, day.day, 12))
+    is_today = now.date() == datetime.now(TZ).date()
+    if is_today and _render_cache_date != now.date().isoformat():
+        _render_cache.clear()
+        _render_cache_date = now.date().isoformat()
+
+    state = load_astro_state()
+    records: List[Dict[str, Any]] = []
+    result: Dict[Tuple[str, str], str] = {}
+    for sign in dict.fromkeys(signs):
+        pattern = None
+        for lang in dict.fromkeys(langs):
+            key = (sign, lang)
+            text = _render_cache.get(key) if is_today else None
+            if is_today:
+                _render_stats["hits" if text is not None else "misses"] += 1
+            if text is None:
+                if pattern is None:
+                    pattern = _pick_pattern(sign, now, state, records)
+                text = _build_horoscope_text(sign, lang, now, pattern)
+                if is_today:
+                    _render_cache[key] = text
+            result[key] = text
+    _astro_state.apply(records)
+    return result
+
+
 # ---------- ТАРО ----------
 
 def _tarot_heading(lang: str) -> str:
@@ -821,8 +974,7 @@ def draw_tarot_for_user(user_id: int, lang: str = "ru") -> Dict[str, Any]:
     today = now.date()
 
     state = load_astro_state()
-    tarot_state = state.setdefault("tarot", {})
-    users_state = tarot_state.setdefault("users", {})
+    users_state = state.get("tarot", {}).get("users", {})
 
     key = str(user_id)
     user_entry = users_state.get(key)
@@ -846,10 +998,9 @@ def draw_tarot_for_user(user_id: int, lang: str = "ru") -> Dict[str, Any]:
             }
 
     card = random.choice(TAROT_CARDS)
-    users_state[key] = {"date": today.isoformat(), "card_id": card["id"]}
-    tarot_state["users"] = users_state
-    state["tarot"] = tarot_state
-    save_astro_state(state)
+    _astro_state.set(
+        ["tarot", "users", key], {"date": today.isoformat(), "card_id": card["id"]}
+    )
 
     title = card["title"][lang]
     short = card["short"][lang]
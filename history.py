@@ -1,93 +1,204 @@
+"""
+История выданных шаблонов по знакам (анти-повтор).
+
+В памяти у каждого знака — deque пар (id, дата) не длиннее KEEP записей,
+get_recent_template_ids() читает только её и ничего не пишет на диск.
+remember_template_id() дописывает одну короткую строку JSONL в конец
+HISTORY_LOG. Каждые COMPACT_EVERY строк фоновый поток переписывает журнал
+одним снимком окон (tmp + rename): строки, дописанные за время
+переписывания, переносятся в новый файл перед подменой.
+
+Старый HISTORY_FILE (JSON целиком) при первом обращении переносится
+в журнал один раз, сам файл не трогаем.
+"""
 import json
 import os
+import logging
 import datetime
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
 
-HISTORY_FILE = "astro_templates_history.json"
-
-
-def _load_history() -> dict:
-    """
-    Загружаем историю шаблонов из JSON.
-    Формат:
-    {
-        "♌ Лев": [
-            {"id": "love_positive_1", "date": "2025-11-19"},
-            ...
-        ],
-        "♊ Близнецы": [...],
-        ...
-    }
-    """
-    if not os.path.exists(HISTORY_FILE):
-        return {}
-
-    try:
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-    except Exception:
-        # Если файл битый — игнорируем и начинаем с чистого листа
-        pass
+logger = logging.getLogger(__name__)
 
-    return {}
-
-
-def _save_history(data: dict) -> None:
-    """Сохраняем историю шаблонов в JSON."""
-    with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+HISTORY_FILE = "astro_templates_history.json"
+HISTORY_LOG = "astro_templates_history.log"
+KEEP = 50
+COMPACT_EVERY = 1000
+
+
+def _line(sign: str, template_id: str, day: str) -> str:
+    return json.dumps({"s": sign, "id": template_id, "d": day}, ensure_ascii=False) + "\n"
+
+
+class TemplateHistory:
+    """Окна (id, дата) по знакам в памяти + журнал с фоновым сжатием."""
+
+    def __init__(self, log_path: Path, legacy_path: Optional[Path] = None,
+                 keep: int = KEEP, compact_every: int = COMPACT_EVERY):
+        self.log_path = log_path
+        self.legacy_path = legacy_path
+        self.keep = keep
+        self.compact_every = compact_every
+        self.windows: Dict[str, Deque[Tuple[str, str]]] = {}
+        self._log = None
+        self._loaded = False
+        self._lines = 0  # строк в журнале с последнего сжатия
+        self._during: Optional[List[str]] = None  # дописанные во время сжатия
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _window(self, sign: str) -> Deque[Tuple[str, str]]:
+        window = self.windows.get(sign)
+        if window is None:
+            window = self.windows[sign] = deque(maxlen=self.keep)
+        return window
+
+    # ------------------------------ загрузка ------------------------------
+
+    def _load(self) -> None:
+        if self._log is not None:
+            return
+        if not self._loaded:
+            self._read()
+            self._loaded = True
+        self._log = self.log_path.open("a", encoding="utf-8")
+
+    def _read(self) -> None:
+        if self.log_path.exists():
+            with self.log_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        self._window(rec["s"]).append((str(rec["id"]), rec["d"]))
+                    except Exception:
+                        # оборванная последняя строка после падения
+                        logger.warning(f"Пропущена битая запись {self.log_path}")
+                        continue
+                    self._lines += 1
+        elif self.legacy_path is not None and self.legacy_path.exists():
+            self._import_legacy()
+
+    def _import_legacy(self) -> None:
+        try:
+            with self.legacy_path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения {self.legacy_path}: {e}")
+            return
+        for sign, items in (data.items() if isinstance(data, dict) else ()):
+            for item in items if isinstance(items, list) else ():
+                if isinstance(item, dict) and item.get("id") and item.get("date"):
+                    self._window(sign).append((str(item["id"]), str(item["date"])))
+        self._write_snapshot(self._snapshot(), [])
+        logger.info(f"История шаблонов перенесена из {self.legacy_path} в {self.log_path}")
+
+    # ------------------------------- чтение -------------------------------
+
+    def recent(self, sign: str, days: int = 14) -> set:
+        cutoff = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+        with self._lock:
+            self._load()
+            window = self.windows.get(sign)
+            if not window:
+                return set()
+            # записи идут по возрастанию даты — старые всегда слева
+            while window and window[0][1] < cutoff:
+                window.popleft()
+            return {template_id for template_id, _ in window}
+
+    # ------------------------------- запись -------------------------------
+
+    def remember(self, sign: str, template_id: str) -> None:
+        day = datetime.date.today().isoformat()
+        line = _line(sign, str(template_id), day)
+        with self._lock:
+            self._load()
+            self._window(sign).append((str(template_id), day))
+            self._log.write(line)
+            self._log.flush()
+            self._lines += 1
+            if self._during is not None:
+                self._during.append(line)
+            elif self._lines >= self.compact_every:
+                self._during = []
+                self._thread = threading.Thread(
+                    target=self._compact, args=(self._snapshot(),), daemon=True
+                )
+                self._thread.start()
+
+    # ------------------------------- сжатие -------------------------------
+
+    def _snapshot(self) -> List[str]:
+        return [
+            _line(sign, template_id, day)
+            for sign, window in self.windows.items()
+            for template_id, day in window
+        ]
+
+    def _write_snapshot(self, lines: List[str], extra: List[str]) -> None:
+        tmp = self.log_path.with_name(self.log_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.writelines(extra)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.log_path)
+        self._lines = len(extra)
+
+    def _compact(self, lines: List[str]) -> None:
+        try:
+            # основную часть пишем без блокировки, под ней — только то,
+            # что успели дописать за это время, и подмену файла
+            tmp = self.log_path.with_name(self.log_path.name + ".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                f.writelines(lines)
+            with self._lock:
+                extra = self._during or []
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+                with tmp.open("a", encoding="utf-8") as f:
+                    f.writelines(extra)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.log_path)
+                self._lines = len(extra)
+                self._log = self.log_path.open("a", encoding="utf-8")
+        except Exception as e:
+            logger.error(f"Ошибка сжатия {self.log_path}: {e}")
+            with self._lock:
+                self._lines = 0  # следующая попытка — через compact_every строк
+                if self._log is None:
+                    self._log = self.log_path.open("a", encoding="utf-8")
+        finally:
+            with self._lock:
+                self._during = None
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+_history = TemplateHistory(Path(HISTORY_LOG), Path(HISTORY_FILE))
 
 
 def get_recent_template_ids(sign: str, days: int = 14) -> set:
     """
     Вернуть set ID шаблонов, которые уже использовались для знака `sign`
-    за последние `days` дней.
-    Одновременно чистим старые записи (старше days).
+    за последние `days` дней. Старые записи отбрасываются только в памяти.
     """
-    data = _load_history()
-    sign_records = data.get(sign, [])
-
-    cutoff = datetime.date.today() - datetime.timedelta(days=days)
-
-    recent_ids = set()
-    new_sign_records = []
-
-    for item in sign_records:
-        try:
-            used_date = datetime.date.fromisoformat(item.get("date", ""))
-        except Exception:
-            # если дата битая — пропускаем
-            continue
-
-        if used_date >= cutoff:
-            recent_ids.add(item.get("id"))
-            new_sign_records.append(item)
-
-    # если что-то подчистили — перезаписываем
-    if len(new_sign_records) != len(sign_records):
-        data[sign] = new_sign_records
-        _save_history(data)
-
-    return recent_ids
+    return _history.recent(sign, days)
 
 
 def remember_template_id(sign: str, template_id: str) -> None:
     """
     Запоминаем, что для знака `sign` сегодня был выдан шаблон `template_id`.
-    Храним не больше 50 последних записей на знак, чтобы не раздувать файл.
+    Храним не больше KEEP последних записей на знак.
     """
-    data = _load_history()
-    sign_records = data.get(sign, [])
-
-    sign_records.append(
-        {
-            "id": str(template_id),
-            "date": datetime.date.today().isoformat(),
-        }
-    )
-
-    # ограничим историю по размеру
-    data[sign] = sign_records[-50:]
-
-    _save_history(data)
+    _history.remember(sign, template_id)
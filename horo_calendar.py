@@ -0,0 +1,239 @@
+"""
+Календарь паттернов гороскопа на год, посчитанный заранее.
+
+    python horo_calendar.py --year 2026 [--window 14] [--seed 1]
+
+Для каждого знака и каждого дня года выбирается паттерн (индексы фраз),
+так чтобы:
+- один и тот же паттерн знака не повторялся ближе, чем через window дней;
+- одна и та же фраза поля не повторялась ближе, чем через
+  min(window, размер пула // 2) дней;
+- фразы расходовались равномерно: берётся наименее использованная знаком,
+  при равенстве — та, что реже встречается у других знаков в этот день.
+
+Файл — заголовок + плотный массив записей по (знак, день года), поэтому
+generate() находит паттерн за O(1) и ничего не пишет в состояние.
+В заголовке хранится подпись пулов фраз: если PHRASES поменялись,
+календарь считается устаревшим и generate() откатывается на старый путь.
+"""
+import sys
+import json
+import zlib
+import struct
+import random
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MAGIC = b"ASTROCAL"
+VERSION = 1
+# magic, version, year, window, signs, days, подпись пулов
+HEADER = struct.Struct("<8sHHHHHI")
+
+# Порядок байтов в записи. number хранится значением, остальное — индексами.
+FIELDS = (
+    "season_idx",
+    "day_type_idx",
+    "love_idx",
+    "work_idx",
+    "money_idx",
+    "health_idx",
+    "advice_idx",
+    "color_idx",
+    "number",
+)
+RECORD = struct.Struct("<" + "B" * len(FIELDS))
+
+# поле паттерна -> ключ пула в PHRASES["ru"]
+POOLS = {
+    "day_type_idx": "day_types",
+    "love_idx": "love",
+    "work_idx": "work",
+    "money_idx": "money",
+    "health_idx": "health",
+    "advice_idx": "advice",
+    "color_idx": "colors",
+}
+
+
+def season_of(day: date) -> str:
+    m = day.month
+    if m in (12, 1, 2):
+        return "winter"
+    if m in (3, 4, 5):
+        return "spring"
+    if m in (6, 7, 8):
+        return "summer"
+    return "autumn"
+
+
+def pool_signature(signs: Sequence[str], phrases: Dict[str, Any], numbers: Sequence[int]) -> int:
+    """crc32 от порядка знаков и размеров всех пулов фраз во всех языках."""
+    sizes = {
+        lang: {
+            "season": {k: len(v) for k, v in ph["season"].items()},
+            **{pool: len(ph[pool]) for pool in POOLS.values()},
+        }
+        for lang, ph in phrases.items()
+    }
+    blob = json.dumps([list(signs), sizes, list(numbers)], sort_keys=True, ensure_ascii=False)
+    return zlib.crc32(blob.encode("utf-8"))
+
+
+def calendar_path(base_dir: Path, year: int) -> Path:
+    return base_dir / f"horoscope_calendar_{year}.bin"
+
+
+class HoroscopeCalendar:
+    """Готовый календарь одного года: паттерн по (номер знака, дата)."""
+
+    def __init__(self, data: bytes):
+        magic, version, year, window, signs, days, signature = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("не календарь гороскопов или неизвестная версия")
+        if len(data) != HEADER.size + signs * days * RECORD.size:
+            raise ValueError("файл календаря обрезан")
+        self.data = data
+        self.year = year
+        self.window = window
+        self.signs = signs
+        self.days = days
+        self.signature = signature
+
+    @classmethod
+    def open(cls, path: Path, signature: int) -> Optional["HoroscopeCalendar"]:
+        """Загрузить календарь; None, если файла нет или он не подходит к PHRASES."""
+        try:
+            cal = cls(path.read_bytes())
+        except (OSError, ValueError, struct.error):
+            return None
+        if cal.signature != signature:
+            return None
+        return cal
+
+    def pattern(self, sign_idx: int, day: date) -> Optional[Dict[str, Any]]:
+        if day.year != self.year or not 0 <= sign_idx < self.signs:
+            return None
+        offset = HEADER.size + (sign_idx * self.days + day.timetuple().tm_yday - 1) * RECORD.size
+        values = RECORD.unpack_from(self.data, offset)
+        pattern: Dict[str, Any] = dict(zip(FIELDS, values))
+        pattern["season_key"] = season_of(day)
+        return pattern
+
+
+# ------------------------------- построение -------------------------------
+
+
+class _FieldPicker:
+    """Выбор индекса в одном пуле для одного знака: разнос повторов + равномерность."""
+
+    def __init__(self, size: int, spacing: int):
+        self.size = size
+        self.spacing = spacing
+        self.counts = [0] * size
+        self.last_used = [-size - spacing - 1] * size
+
+    def candidates(self, day_no: int, day_usage: List[int], strict: bool = True) -> List[int]:
+        eligible = [i for i in range(self.size) if day_no - self.last_used[i] > self.spacing]
+        if not strict:
+            return eligible
+        best = min((self.counts[i], day_usage[i]) for i in eligible)
+        return [i for i in eligible if (self.counts[i], day_usage[i]) == best]
+
+    def take(self, idx: int, day_no: int) -> None:
+        self.counts[idx] += 1
+        self.last_used[idx] = day_no
+
+
+def build_calendar(
+    year: int,
+    signs: Sequence[str],
+    phrases: Dict[str, Any],
+    numbers: Sequence[int],
+    window: int = 14,
+    seed: Optional[int] = None,
+) -> bytes:
+    rng = random.Random(seed)
+    ru = phrases["ru"]
+    first = date(year, 1, 1)
+    days = (date(year + 1, 1, 1) - first).days
+
+    def sizes_for(season: str) -> Dict[str, int]:
+        sizes = {field: len(ru[pool]) for field, pool in POOLS.items()}
+        sizes["season_idx"] = len(ru["season"][season])
+        sizes["number"] = len(numbers)
+        return sizes
+
+    def spacing(size: int) -> int:
+        return min(window, size // 2)
+
+    # пикеры на (знак, поле[, сезон])
+    pickers: Dict[Tuple[int, str, str], _FieldPicker] = {}
+    recent: List[List[Tuple[int, ...]]] = [[] for _ in signs]
+    rows: List[List[bytes]] = [[] for _ in signs]
+
+    for day_no in range(days):
+        day = first + timedelta(days=day_no)
+        season = season_of(day)
+        sizes = sizes_for(season)
+        # сколько раз каждая фраза уже выпала другим знакам в этот день
+        usage = {field: [0] * size for field, size in sizes.items()}
+        for s in range(len(signs)):
+            for attempt in range(100):
+                chosen: List[int] = []
+                for field in FIELDS:
+                    key = (s, field, season if field == "season_idx" else "")
+                    picker = pickers.get(key)
+                    if picker is None:
+                        picker = pickers[key] = _FieldPicker(sizes[field], spacing(sizes[field]))
+                    chosen.append(rng.choice(picker.candidates(day_no, usage[field], attempt == 0)))
+                values = tuple(chosen)
+                if values not in recent[s]:
+                    break
+            else:
+                raise ValueError(f"не удалось избежать повтора для {signs[s]} на {day}")
+            for field, idx in zip(FIELDS, values):
+                key = (s, field, season if field == "season_idx" else "")
+                pickers[key].take(idx, day_no)
+                usage[field][idx] += 1
+            if window:
+                recent[s].append(values)
+                del recent[s][:-window]
+            number_idx = values[FIELDS.index("number")]
+            record = values[:-1] + (numbers[number_idx],)
+            rows[s].append(RECORD.pack(*record))
+
+    signature = pool_signature(signs, phrases, numbers)
+    header = HEADER.pack(MAGIC, VERSION, year, window, len(signs), days, signature)
+    return header + b"".join(b"".join(r) for r in rows)
+
+
+def main(argv=None) -> None:
+    import generator
+
+    parser = argparse.ArgumentParser(description="Собрать календарь паттернов гороскопа на год")
+    parser.add_argument("--year", type=int, default=date.today().year)
+    parser.add_argument("--window", type=int, default=14, help="минимум дней между одинаковыми паттернами знака")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    data = build_calendar(
+        args.year,
+        generator.ZODIAC_SIGNS,
+        generator.PHRASES,
+        generator.NUMBERS,
+        window=args.window,
+        seed=args.seed,
+    )
+    out = Path(args.out) if args.out else calendar_path(generator.BASE_DIR, args.year)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(out)
+    cal = HoroscopeCalendar(data)
+    print(f"{out}: {cal.signs} знаков × {cal.days} дней, окно {cal.window}, {len(data)} байт")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
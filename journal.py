@@ -0,0 +1,197 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+from user_repo import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+
+def _container(root: Dict[str, Any], path: Sequence[str]) -> Dict[str, Any]:
+    node = root
+    for key in path:
+        nxt = node.get(key)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            node[key] = nxt
+        node = nxt
+    return node
+
+
+def _apply(root: Dict[str, Any], rec: Dict[str, Any]) -> None:
+    path = rec["path"]
+    parent = _container(root, path[:-1])
+    key = path[-1]
+    op = rec["op"]
+    if op == "set":
+        parent[key] = rec["value"]
+    elif op == "del":
+        parent.pop(key, None)
+    elif op == "push":
+        items = parent.get(key)
+        if not isinstance(items, list):
+            items = []
+        items.append(rec["value"])
+        keep = rec.get("keep")
+        parent[key] = items[-keep:] if keep else items
+
+
+class JournaledState:
+    """
+    Состояние в памяти + журнал изменений (JSONL) + периодический снимок.
+
+    Снимок — обычный JSON того же формата, что раньше был в файле, журнал —
+    короткие записи вида {"op": "set"|"del"|"push", "path": [...], "value": ...}.
+    Старт: загрузка снимка и проигрывание журнала. Изменение — одна запись
+    в конец журнала. Каждые compact_every записей снимок переписывается
+    атомарно (tmp + rename), а журнал обнуляется.
+
+    Записи нумеруются (seq), номер последней учтённой записи хранится в
+    снимке под ключом SEQ_KEY. Если процесс упал между записью снимка и
+    очисткой журнала, при старте уже учтённые записи просто пропускаются.
+    """
+
+    SEQ_KEY = "_journal_seq"
+
+    def __init__(
+        self,
+        snapshot_path: Path,
+        journal_path: Optional[Path] = None,
+        compact_every: int = 1000,
+        fsync: bool = False,
+    ):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or snapshot_path.with_suffix(".journal")
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.data: Dict[str, Any] = {}
+        self._records = 0
+        self._seq = 0
+        self._journal = None
+        self._loaded = False
+        self._torn_end: Optional[int] = None
+        self._lock = threading.RLock()
+
+    # ------------------------------ загрузка ------------------------------
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            self.data = {}
+            if self.snapshot_path.exists():
+                try:
+                    with self.snapshot_path.open("r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if isinstance(data, dict):
+                        self.data = data
+                except Exception as e:
+                    logger.error(f"Ошибка чтения {self.snapshot_path}: {e}")
+            self._seq = int(self.data.pop(self.SEQ_KEY, 0) or 0)
+            self._records = 0
+            self._torn_end = None
+            if self.journal_path.exists():
+                end = 0  # конец последней целой строки
+                with self.journal_path.open("rb") as f:
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        end += len(line)
+                        try:
+                            rec = json.loads(line)
+                            if rec.get("seq", 0) <= self._seq:
+                                continue
+                            _apply(self.data, rec)
+                        except Exception:
+                            logger.warning(f"Пропущена битая запись журнала {self.journal_path}")
+                            continue
+                        self._seq = rec["seq"]
+                        self._records += 1
+                    torn = f.seek(0, os.SEEK_END) - end
+                if torn:
+                    # оборванная последняя строка после падения; обрезает её
+                    # первая дозапись (load() сам файлы не меняет — так журнал
+                    # можно читать и со стороны, см. migrate.py)
+                    logger.warning(f"{self.journal_path.name}: оборванный хвост ({torn} байт)")
+                    self._torn_end = end
+            self._loaded = True
+            return self.data
+
+    def state(self) -> Dict[str, Any]:
+        """Живое состояние (загружается при первом обращении)."""
+        if not self._loaded:
+            self.load()
+        return self.data
+
+    # ------------------------------- запись -------------------------------
+
+    def set(self, path: Sequence[str], value: Any) -> None:
+        self.apply([{"op": "set", "path": list(path), "value": value}])
+
+    def delete(self, path: Sequence[str]) -> None:
+        self.apply([{"op": "del", "path": list(path)}])
+
+    def push(self, path: Sequence[str], value: Any, keep: Optional[int] = None) -> None:
+        rec = {"op": "push", "path": list(path), "value": value}
+        if keep:
+            rec["keep"] = keep
+        self.apply([rec])
+
+    def apply(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Применить пачку изменений и дописать их в журнал одной записью."""
+        with self._lock:
+            self.state()
+            records = list(records)
+            if not records:
+                return
+            for rec in records:
+                self._seq += 1
+                rec["seq"] = self._seq
+                _apply(self.data, rec)
+            payload = "".join(
+                json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+                for rec in records
+            )
+            if self._journal is None:
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                if self._torn_end is not None:
+                    # иначе новая запись склеится с оборванной и тоже пропадёт
+                    os.truncate(self.journal_path, self._torn_end)
+                    self._torn_end = None
+                self._journal = self.journal_path.open("a", encoding="utf-8")
+            self._journal.write(payload)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._records += len(records)
+            if self._records >= self.compact_every:
+                self.compact()
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        """Заменить состояние целиком (сразу пишется снимок)."""
+        with self._lock:
+            self.data = data
+            self._loaded = True
+            self.compact()
+
+    def compact(self) -> None:
+        with self._lock:
+            snapshot = {**self.data, self.SEQ_KEY: self._seq}
+            atomic_write_text(
+                self.snapshot_path,
+                json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")),
+            )
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = self.journal_path.open("w", encoding="utf-8")
+            self._torn_end = None
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._records = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
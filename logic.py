@@ -2,10 +2,9 @@ def generate_message(user_id: int, zodiac: str) -> str:
     from datetime import datetime
     import random
     from content import get_season, SEASON_TEMPLATES, HABIT_TIPS, talisman_for_month
-    from store import filter_allowed, remember_template, monthly_reset_messages, append_message
+    from store import session
 
     now = datetime.utcnow()
-    monthly_reset_messages(user_id)
 
     season = get_season(now)
     # перевод сезона на русский
@@ -16,24 +15,27 @@ def generate_message(user_id: int, zodiac: str) -> str:
         "winter": "зима",
     }
     season_ru = season_names.get(season, season)
-
     seasonal_pool = SEASON_TEMPLATES.get(season, [])
-    allowed = filter_allowed(user_id, seasonal_pool, N=6, days=14)
-    pool = allowed if allowed else seasonal_pool
-    tid, line = random.choice(pool)
 
-    remember_template(user_id, tid)
-    tip = random.choice(random.choice(list(HABIT_TIPS.values())))
-    tal_name, tal_emoji, tal_mean = talisman_for_month(now)
+    # одно чтение и одна транзакция на всё сообщение
+    with session(user_id) as s:
+        s.monthly_reset()
 
-    msg = (
-        f"{zodiac}\n"
-        f"Сезон: {season_ru}\n\n"
-        f"{line}\n\n"
-        f"🪄 Талисман месяца: {tal_emoji} {tal_name} — {tal_mean}.\n"
-        f"🧩 Привычка дня: {tip}"
-    )
+        allowed = s.filter_allowed(seasonal_pool, N=6, days=14)
+        pool = allowed if allowed else seasonal_pool
+        tid, line = random.choice(pool)
 
-    append_message(user_id, msg)
-    return msg
+        s.remember_template(tid)
+        tip = random.choice(random.choice(list(HABIT_TIPS.values())))
+        tal_name, tal_emoji, tal_mean = talisman_for_month(now)
 
+        msg = (
+            f"{zodiac}\n"
+            f"Сезон: {season_ru}\n\n"
+            f"{line}\n\n"
+            f"🪄 Талисман месяца: {tal_emoji} {tal_name} — {tal_mean}.\n"
+            f"🧩 Привычка дня: {tip}"
+        )
+
+        s.append_message(msg)
+    return msg
@@ -0,0 +1,528 @@
+"""
+Перенос состояния из JSON-файлов в единую SQLite-схему storage.py.
+
+    python migrate.py [--dir .] [--batch 5000] [--reset]
+
+Файлы читаются потоково (по одной записи верхнего уровня), запись идёт
+большими транзакциями. Вместе с каждой пачкой в migration_progress
+сохраняется байтовое смещение в исходном файле, поэтому прерванный запуск
+продолжается с места остановки, а повторный ничего не меняет: все вставки —
+upsert'ы по первичным ключам.
+
+Порядок источников задаёт приоритет при конфликтах: более поздний
+перезаписывает поля более раннего. Старые колонки astrobot.db <
+astro_users.json < storage.json < users_state.json (его reminder_time —
+то, что реально использует бот, — побеждает daily_time/time).
+"""
+import os
+import sys
+import json
+import time
+import codecs
+import tempfile
+import argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from content import ZODIAC
+
+CHUNK_SIZE = 1 << 20
+
+# ------------------------- потоковое чтение JSON -------------------------
+
+
+class _Reader:
+    """Буфер поверх бинарного файла с учётом байтового смещения."""
+
+    def __init__(self, f, start: int):
+        f.seek(start)
+        self.f = f
+        self.base = start  # байтовое смещение символа self.buf[self.mark]
+        self.buf = ""
+        self.pos = 0
+        self.mark = 0
+        self.eof = False
+        self._dec = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        if self.pos > CHUNK_SIZE:
+            self.offset()
+            self.buf = self.buf[self.pos:]
+            self.pos = self.mark = 0
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            self.buf += self._dec.decode(b"", final=True)
+            return False
+        self.buf += self._dec.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"ожидали {ch!r}, получили {got!r} на байте {self.offset()}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # число могло оборваться на границе чанка
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def offset(self) -> int:
+        # кодируем только прочитанное с прошлого вызова, а не весь буфер
+        self.base += len(self.buf[self.mark: self.pos].encode("utf-8"))
+        self.mark = self.pos
+        return self.base
+
+
+def iter_json_object(
+    path: Path, keys: Tuple[str, ...] = (), start: int = 0
+) -> Iterator[Tuple[str, Any, int]]:
+    """
+    Пары (ключ, значение, смещение после значения) объекта по пути keys,
+    не загружая файл целиком. start — смещение, полученное ранее: чтение
+    продолжается со следующей пары.
+    """
+    with open(path, "rb") as f:
+        r = _Reader(f, start)
+        if start == 0:
+            if r.peek() != "{":
+                return
+            r.expect("{")
+            for wanted in keys:
+                while True:
+                    if r.peek() == ",":
+                        r.expect(",")
+                    if r.peek() in ("}", ""):
+                        return
+                    key = r.value()
+                    r.expect(":")
+                    if key == wanted and r.peek() == "{":
+                        r.expect("{")
+                        break
+                    r.value()
+        while True:
+            ch = r.peek()
+            if ch == ",":
+                r.expect(",")
+                ch = r.peek()
+            if ch in ("}", ""):
+                return
+            key = r.value()
+            r.expect(":")
+            yield key, r.value(), r.offset()
+
+
+# ------------------------------ нормализация ------------------------------
+
+_SIGN_CODES: Dict[str, str] = {}
+for _code, _label in ZODIAC.items():
+    _SIGN_CODES[_code] = _code
+    _SIGN_CODES[_label] = _code
+    _SIGN_CODES[_label.split(" ", 1)[1]] = _code
+
+
+def sign_code(value: Any) -> Optional[str]:
+    """'Овен' / '♈ Овен' / 'aries' -> 'aries'."""
+    if not isinstance(value, str):
+        return None
+    return _SIGN_CODES.get(value.strip()) or _SIGN_CODES.get(value.strip().lower())
+
+
+def _hhmm(value: Any) -> Optional[str]:
+    if not isinstance(value, str) or ":" not in value:
+        return None
+    try:
+        hour, minute = (int(x) for x in value.split(":", 1))
+    except ValueError:
+        return None
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+# ------------------------------- источники -------------------------------
+# Каждый обработчик получает (ключ, значение) и возвращает
+# (изменения users для storage.apply_user_changes, [(sql, params), ...]).
+
+Rows = List[Tuple[str, tuple]]
+UserChanges = List[Tuple[int, Dict[str, Any]]]
+
+SQL_TEMPLATE = (
+    "INSERT OR IGNORE INTO template_history (scope, owner, used_at, template_id) "
+    "VALUES (?, ?, ?, ?)"
+)
+SQL_MESSAGE = (
+    "INSERT INTO user_messages (user_id, seq, ts, text) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(user_id, seq) DO UPDATE SET ts=excluded.ts, text=excluded.text"
+)
+SQL_PATTERN = (
+    "INSERT INTO sign_patterns (sign, date, pattern) VALUES (?, ?, ?) "
+    "ON CONFLICT(sign, date) DO UPDATE SET pattern=excluded.pattern"
+)
+SQL_TAROT = (
+    "INSERT INTO tarot_draws (user_id, date, card_id) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET date=excluded.date, card_id=excluded.card_id"
+)
+
+
+def _uid(key: str) -> Optional[int]:
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return None
+
+
+def _astro_users(key: str, u: Any) -> Tuple[UserChanges, Rows]:
+    uid = _uid(key)
+    if uid is None or not isinstance(u, dict):
+        return [], []
+    fields: Dict[str, Any] = {}
+    code = sign_code(u.get("sign"))
+    if code:
+        fields["sign"] = code
+    if "daily_enabled" in u:
+        fields["daily_on"] = 1 if u["daily_enabled"] else 0
+    t = _hhmm(u.get("time") or u.get("daily_time"))
+    if t:
+        fields["daily_time"] = t
+    if u.get("tz"):
+        fields["tz"] = u["tz"]
+    return [(uid, fields)], []
+
+
+def _store_users(key: str, u: Any) -> Tuple[UserChanges, Rows]:
+    uid = _uid(key)
+    if uid is None or not isinstance(u, dict):
+        return [], []
+    fields: Dict[str, Any] = {}
+    code = sign_code((u.get("profile") or {}).get("sign"))
+    if code:
+        fields["sign"] = code
+    if u.get("last_month"):
+        fields["last_month"] = u["last_month"]
+    rows: Rows = []
+    for item in u.get("used") or []:
+        if isinstance(item, dict) and item.get("id") and item.get("ts"):
+            rows.append((SQL_TEMPLATE, ("user", key, item["ts"], str(item["id"]))))
+    for seq, m in enumerate(u.get("messages") or []):
+        if isinstance(m, dict):
+            rows.append((SQL_MESSAGE, (uid, seq, m.get("ts"), m.get("text"))))
+    return [(uid, fields)], rows
+
+
+def _bot_users(key: str, u: Any) -> Tuple[UserChanges, Rows]:
+    uid = _uid(key)
+    if uid is None or not isinstance(u, dict):
+        return [], []
+    fields: Dict[str, Any] = {}
+    code = sign_code(u.get("sign"))
+    if code:
+        fields["sign"] = code
+    if u.get("lang") in ("ru", "en", "es"):
+        fields["lang"] = u["lang"]
+    if "reminder_time" in u:
+        t = _hhmm(u["reminder_time"])
+        fields["daily_on"] = 1 if t else 0
+        if t:
+            fields["daily_time"] = t
+    return [(uid, fields)], []
+
+
+def _sign_history(key: str, items: Any) -> Tuple[UserChanges, Rows]:
+    owner = sign_code(key) or key
+    rows: Rows = []
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and item.get("id") and item.get("date"):
+            rows.append((SQL_TEMPLATE, ("sign", owner, item["date"], str(item["id"]))))
+    return [], rows
+
+
+def _sign_patterns(key: str, st: Any) -> Tuple[UserChanges, Rows]:
+    if not isinstance(st, dict):
+        return [], []
+    code = sign_code(key) or key
+    entries = list(st.get("history") or [])
+    if isinstance(st.get("today"), dict):
+        entries.append(st["today"])
+    rows: Rows = []
+    for e in entries:
+        if isinstance(e, dict) and e.get("date") and e.get("pattern"):
+            rows.append(
+                (SQL_PATTERN, (code, e["date"], json.dumps(e["pattern"], ensure_ascii=False)))
+            )
+    return [], rows
+
+
+def _tarot_users(key: str, e: Any) -> Tuple[UserChanges, Rows]:
+    uid = _uid(key)
+    if uid is None or not isinstance(e, dict) or not e.get("date") or not e.get("card_id"):
+        return [], []
+    return [], [(SQL_TAROT, (uid, e["date"], e["card_id"]))]
+
+
+# (имя, файл, путь к объекту внутри файла, обработчик) — в порядке приоритета
+SOURCES: List[Tuple[str, str, Tuple[str, ...], Callable]] = [
+    ("astro_users", "astro_users.json", (), _astro_users),
+    ("store_users", "storage.json", ("users",), _store_users),
+    ("bot_users", "users_state.json", (), _bot_users),
+    ("sign_history", "astro_templates_history.json", (), _sign_history),
+    ("sign_patterns", "astro_state.json", ("signs",), _sign_patterns),
+    ("tarot_draws", "astro_state.json", ("tarot", "users"), _tarot_users),
+]
+
+# ------------------------------- прогон -------------------------------
+
+
+def _init_progress(db) -> None:
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS migration_progress (
+        source       TEXT PRIMARY KEY,
+        byte_offset  INTEGER NOT NULL DEFAULT 0,
+        rows         INTEGER NOT NULL DEFAULT 0,
+        done         INTEGER NOT NULL DEFAULT 0
+    )""")
+
+
+def _progress(db, source: str) -> Tuple[int, int, int]:
+    row = db.execute(
+        "SELECT byte_offset, rows, done FROM migration_progress WHERE source=?", (source,)
+    ).fetchone()
+    return (row[0], row[1], row[2]) if row else (0, 0, 0)
+
+
+def _checkpoint(db, source: str, offset: int, rows: int, done: bool) -> None:
+    db.execute(
+        "INSERT INTO migration_progress (source, byte_offset, rows, done) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(source) DO UPDATE SET byte_offset=excluded.byte_offset, "
+        "rows=excluded.rows, done=excluded.done",
+        (source, offset, rows, 1 if done else 0),
+    )
+
+
+def _migrate_legacy_columns(storage) -> int:
+    """Старая схема astrobot.db: sign_code / daily_enabled / notify_hour+minute."""
+    with storage.batch() as db:
+        _init_progress(db)
+        if _progress(db, "legacy_columns")[2]:
+            return 0
+        cols = {r["name"] for r in db.execute("PRAGMA table_info(users)")}
+        changes: UserChanges = []
+        if {"sign_code", "daily_enabled", "notify_hour", "notify_minute"} <= cols:
+            for r in db.execute(
+                "SELECT user_id, sign_code, daily_enabled, notify_hour, notify_minute FROM users"
+            ):
+                fields: Dict[str, Any] = {"daily_on": 1 if r["daily_enabled"] else 0}
+                code = sign_code(r["sign_code"])
+                if code:
+                    fields["sign"] = code
+                if r["notify_hour"] is not None:
+                    fields["daily_time"] = f"{int(r['notify_hour']):02d}:{int(r['notify_minute'] or 0):02d}"
+                changes.append((r["user_id"], fields))
+        rows = storage.apply_user_changes(changes)
+        _checkpoint(db, "legacy_columns", 0, rows, True)
+    return rows
+
+
+def migrate_source(storage, name: str, path: Path, keys: Tuple[str, ...], handler, batch_size: int) -> None:
+    with storage.batch() as db:
+        _init_progress(db)
+        offset, rows, done = _progress(db, name)
+    if done:
+        print(f"{name}: уже перенесено ({rows} строк)")
+        return
+    if not path.exists():
+        with storage.batch() as db:
+            _checkpoint(db, name, 0, 0, True)
+        print(f"{name}: {path.name} нет, пропускаем")
+        return
+
+    started = time.perf_counter()
+    written = 0
+    items = iter_json_object(path, keys, offset)
+    while True:
+        changes: UserChanges = []
+        extra: Rows = []
+        count = 0
+        for key, value, offset in items:
+            ch, rs = handler(key, value)
+            changes.extend(ch)
+            extra.extend(rs)
+            count += 1
+            if count >= batch_size:
+                break
+        finished = count < batch_size
+        with storage.batch() as db:
+            written += storage.apply_user_changes(c for c in changes if c[1])
+            for sql, params in extra:
+                db.execute(sql, params)
+            written += len(extra)
+            _checkpoint(db, name, offset, rows + written, finished)
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {rows + written} строк, {written / max(elapsed, 1e-9):,.0f} строк/с")
+        if finished:
+            return
+
+
+def _replay_astro_journal(storage, base: Path, tmp_dir: Path) -> Path:
+    """
+    astro_state.json ведётся как снимок + журнал (journal.py), и бот может
+    дописывать журнал прямо во время миграции. Файлы бота не трогаем:
+    снимок с проигранным журналом пишем во временную копию и читаем её.
+    Смещения по этой копии от запуска к запуску не совпадают, поэтому её
+    источники проходятся заново (upsert'ы).
+    """
+    from journal import JournaledState
+
+    snapshot = base / "astro_state.json"
+    state = JournaledState(snapshot)
+    if not state.journal_path.exists() or state.journal_path.stat().st_size == 0:
+        return snapshot
+    data = state.load()
+    copy = tmp_dir / snapshot.name
+    with copy.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    names = [name for name, filename, _, _ in SOURCES if filename == snapshot.name]
+    with storage.batch() as db:
+        _init_progress(db)
+        db.executemany("DELETE FROM migration_progress WHERE source = ?", [(n,) for n in names])
+    print(f"Журнал {state.journal_path.name} проигран во временную копию снимка")
+    return copy
+
+
+def _fold_user_messages(storage, batch_size: int) -> None:
+    """
+    Сообщения из storage.json (и из прежней таблицы user_messages) живут
+    теперь в журнале msglog.py. Таблица читается страницами по (user_id, seq),
+    примерно по batch_size строк и всегда целыми пользователями. Каждый
+    месяц страницы уходит в свой сегмент (те, что ещё хранятся по
+    keep_months), затем строки страницы удаляются из таблицы в одной
+    транзакции с checkpoint'ом — в byte_offset здесь последний user_id.
+    Перенесённых строк в таблице уже нет, так что прерванный запуск
+    продолжается с первой оставшейся, а страницу, прерванную до удаления,
+    можно просто повторить: replace_month() заменяет истории целиком.
+    """
+    import store
+
+    name = "user_messages"
+    with storage.batch() as db:
+        _init_progress(db)
+        last_uid, rows, done = _progress(db, name)
+        pending = db.execute("SELECT 1 FROM user_messages LIMIT 1").fetchone()
+    if pending is None:
+        if not done:
+            with storage.batch() as db:
+                _checkpoint(db, name, last_uid, rows, True)
+        return
+
+    log = store.messages_log()
+    oldest = log.oldest_kept()
+    skipped = set()
+    started = time.perf_counter()
+    written = 0
+    now = int(time.time())
+    while True:
+        with storage.batch() as db:
+            if written:
+                page = db.execute(
+                    "SELECT user_id, seq, ts, text FROM user_messages WHERE user_id > ? "
+                    "ORDER BY user_id, seq LIMIT ?", (last_uid, batch_size)
+                ).fetchall()
+            else:
+                page = db.execute(
+                    "SELECT user_id, seq, ts, text FROM user_messages ORDER BY user_id, seq LIMIT ?",
+                    (batch_size,),
+                ).fetchall()
+            if len(page) == batch_size:
+                # дочитываем последнего пользователя, чтобы не делить его историю
+                tail = page[-1]
+                page.extend(db.execute(
+                    "SELECT user_id, seq, ts, text FROM user_messages WHERE user_id = ? AND seq > ? "
+                    "ORDER BY seq", (tail["user_id"], tail["seq"])
+                ).fetchall())
+        if not page:
+            with storage.batch() as db:
+                _checkpoint(db, name, last_uid, rows + written, True)
+            break
+
+        months: Dict[str, Dict[int, List[Tuple[int, str]]]] = {}
+        for r in page:
+            ts = store._epoch(r["ts"]) if r["ts"] else now
+            by_user = months.setdefault(time.strftime("%Y-%m", time.gmtime(ts)), {})
+            by_user.setdefault(r["user_id"], []).append((ts, r["text"] or ""))
+        for month, histories in months.items():
+            if month < oldest:
+                skipped.add(month)
+                continue
+            log.replace_month(month, histories)
+
+        first_uid, last_uid = page[0]["user_id"], page[-1]["user_id"]
+        written += len(page)
+        with storage.batch() as db:
+            db.execute("DELETE FROM user_messages WHERE user_id BETWEEN ? AND ?", (first_uid, last_uid))
+            _checkpoint(db, name, last_uid, rows + written, False)
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {rows + written} строк, {written / max(elapsed, 1e-9):,.0f} строк/с")
+    if skipped:
+        print(f"{name}: месяцы {', '.join(sorted(skipped))} старше хранимых ({oldest}), не перенесены")
+    print(f"{name}: {rows + written} строк перенесено в журнал сообщений")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="JSON-хранилища -> SQLite (storage.py)")
+    parser.add_argument("--dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию ASTROBOT_DB/astrobot.db)")
+    parser.add_argument("--batch", type=int, default=5000, help="записей верхнего уровня на транзакцию")
+    parser.add_argument("--reset", action="store_true", help="забыть прогресс и пройти всё заново")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        os.environ["ASTROBOT_DB"] = args.db
+    import storage
+
+    storage.init_db()
+    base = Path(args.dir)
+    if args.reset:
+        with storage.batch() as db:
+            _init_progress(db)
+            db.execute("DELETE FROM migration_progress")
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="astrobot-migrate-") as tmp:
+        astro_state = _replay_astro_journal(storage, base, Path(tmp))
+        _migrate_legacy_columns(storage)
+        for name, filename, keys, handler in SOURCES:
+            path = astro_state if filename == astro_state.name else base / filename
+            migrate_source(storage, name, path, keys, handler, args.batch)
+    _fold_user_messages(storage, args.batch)
+    with storage.batch() as db:
+        total = db.execute("SELECT COALESCE(SUM(rows), 0) FROM migration_progress").fetchone()[0]
+    elapsed = time.perf_counter() - started
+    print(f"Готово: {total} строк всего, {elapsed:.1f}s")
+    storage.close_db()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,305 @@
+"""
+Журнал сообщений пользователей: append-only файлы, по одному на месяц.
+
+    messages/2026-10.log   записи подряд: <qqI (user_id, ts, длина) + текст utf-8
+    messages/2026-10.idx   на каждую запись <qQI (user_id, смещение в .log, длина текста)
+
+Дописывание — по одной записи в конец двух файлов, O(1). Индекс месяца
+поднимается в память один раз при открытии (user_id -> array смещений),
+история пользователя читается одним seek + read на сообщение, чужие
+записи не просматриваются. Новый месяц — просто новый файл: ничего не надо
+чистить по пользователям, старые сегменты (старше keep_months) удаляются
+целиком.
+
+Заменить историю пользователя (store.put_user, migrate.py) — дописать
+в индекс метку RESET и затем новые записи: всё, что было у него в
+сегменте раньше, перестаёт читаться.
+
+Если процесс упал между записью в .log и в .idx, при открытии сегмента
+(и перед каждой дозаписью) недостающие записи индекса восстанавливаются
+из .log, оборванный хвост обрезается.
+
+Писателей у сегмента может быть несколько (migrate.py дописывает месяц,
+пока бот работает): дозапись идёт под flock на .log, смещение берётся от
+фактического конца файла, а чужие записи индекса дочитываются перед
+каждой дозаписью и чтением.
+"""
+import os
+import fcntl
+import struct
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<qqI")
+INDEX = struct.Struct("<qQI")
+RESET = 2 ** 64 - 1
+
+# (ts в epoch-секундах, текст)
+Message = Tuple[int, str]
+
+
+def month_key(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m")
+
+
+class _Segment:
+    """Один месяц: .log/.idx, открытые на дозапись, и индекс в памяти."""
+
+    def __init__(self, directory: Path, month: str, limit: int):
+        self.month = month
+        self.limit = limit
+        self.log_path = directory / f"{month}.log"
+        self.idx_path = directory / f"{month}.idx"
+        # user_id -> (смещения, длины текстов)
+        self.offsets: Dict[int, Tuple[array, array]] = {}
+        self._log = open(self.log_path, "a+b")
+        self._idx = open(self.idx_path, "a+b")
+        self.size = 0  # конец последней записи .log, известной индексу
+        self.idx_size = 0  # прочитано байт .idx
+        with self._locked():
+            self._sync(recover=True)
+
+    @contextmanager
+    def _locked(self):
+        # в сегмент может писать и другой процесс (migrate.py при живом
+        # боте): дозапись и восстановление — только под flock на .log
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._log.fileno(), fcntl.LOCK_UN)
+
+    def _add(self, user_id: int, offset: int, length: int) -> None:
+        if offset == RESET:
+            self.offsets.pop(user_id, None)
+            return
+        entry = self.offsets.get(user_id)
+        if entry is None:
+            entry = self.offsets[user_id] = (array("Q"), array("I"))
+        offsets, lengths = entry
+        offsets.append(offset)
+        lengths.append(length)
+        # читаем не больше limit последних — старые смещения держать незачем
+        if len(offsets) > 2 * self.limit:
+            del offsets[: len(offsets) - self.limit]
+            del lengths[: len(lengths) - self.limit]
+
+    def _sync(self, recover: bool) -> None:
+        """
+        Дочитать записи индекса, дописанные с прошлого раза (в том числе
+        другими процессами). С recover (только под _locked) ещё и обрезать
+        оборванную запись индекса, восстановить недостающие записи из .log
+        и обрезать оборванный хвост .log.
+        """
+        idx_size = os.fstat(self._idx.fileno()).st_size
+        data = os.pread(self._idx.fileno(), idx_size - self.idx_size, self.idx_size) if idx_size > self.idx_size else b""
+        whole = len(data) - len(data) % INDEX.size
+        for user_id, offset, length in INDEX.iter_unpack(memoryview(data)[:whole]):
+            self._add(user_id, offset, length)
+            if offset != RESET:
+                self.size = offset + RECORD.size + length
+        self.idx_size += whole
+        if not recover:
+            return
+        if whole != len(data):
+            logger.warning(f"{self.idx_path.name}: обрезана оборванная запись индекса")
+            self._idx.truncate(self.idx_size)
+
+        log_size = os.fstat(self._log.fileno()).st_size
+        pos = self.size
+        recovered = bytearray()
+        while pos + RECORD.size <= log_size:
+            user_id, _, length = RECORD.unpack(os.pread(self._log.fileno(), RECORD.size, pos))
+            if pos + RECORD.size + length > log_size:
+                break
+            self._add(user_id, pos, length)
+            recovered += INDEX.pack(user_id, pos, length)
+            pos += RECORD.size + length
+        if recovered:
+            logger.warning(
+                f"{self.log_path.name}: восстановлено записей индекса: {len(recovered) // INDEX.size}"
+            )
+            self._idx.write(recovered)
+            self._idx.flush()
+            self.idx_size += len(recovered)
+        if pos < log_size:
+            logger.warning(f"{self.log_path.name}: обрезан оборванный хвост ({log_size - pos} байт)")
+            self._log.truncate(pos)
+        self.size = pos
+
+    def write(self, items: Iterable[Tuple[int, int, str]], fsync: bool) -> None:
+        """items: (user_id, ts, text); ts=None — метка RESET для user_id."""
+        with self._locked():
+            # смещения считаем от фактического конца файла, а не от size,
+            # запомненного при открытии: его мог сдвинуть другой писатель
+            self._sync(recover=True)
+            log = bytearray()
+            idx = bytearray()
+            for user_id, ts, text in items:
+                if ts is None:
+                    idx += INDEX.pack(user_id, RESET, 0)
+                    self._add(user_id, RESET, 0)
+                    continue
+                body = text.encode("utf-8")
+                offset = self.size + len(log)
+                log += RECORD.pack(user_id, int(ts), len(body))
+                log += body
+                idx += INDEX.pack(user_id, offset, len(body))
+                self._add(user_id, offset, len(body))
+            # сначала .log, потом .idx: индекс никогда не указывает за конец лога
+            if log:
+                self._log.write(log)
+                self._log.flush()
+                if fsync:
+                    os.fsync(self._log.fileno())
+                self.size += len(log)
+            if idx:
+                self._idx.write(idx)
+                self._idx.flush()
+                if fsync:
+                    os.fsync(self._idx.fileno())
+                self.idx_size += len(idx)
+
+    def read(self, user_id: int, limit: int) -> List[Message]:
+        # одна fstat: подхватить записи, дописанные другим процессом
+        self._sync(recover=False)
+        entry = self.offsets.get(user_id)
+        if entry is None:
+            return []
+        out: List[Message] = []
+        fd = self._log.fileno()
+        for offset, length in zip(entry[0][-limit:], entry[1][-limit:]):
+            # pread не двигает позицию и не сбрасывает буфер файла
+            raw = os.pread(fd, RECORD.size + length, offset)
+            out.append((RECORD.unpack_from(raw)[1], raw[RECORD.size:].decode("utf-8")))
+        return out
+
+    def close(self) -> None:
+        self._log.close()
+        self._idx.close()
+
+
+class MessageLog:
+    """
+    Сообщения пользователей по месяцам (см. описание модуля).
+
+    read() без month — история текущего месяца, то есть то, что раньше
+    оставалось в списке messages после помесячной очистки.
+    """
+
+    def __init__(self, directory: Path, limit: int = 500, keep_months: int = 3, fsync: bool = False):
+        self.directory = Path(directory)
+        self.limit = limit
+        self.keep_months = keep_months
+        self.fsync = fsync
+        self._segment: Optional[_Segment] = None
+        # прошлые месяцы, открытые replace_month() (перенос идёт страницами)
+        self._others: Dict[str, _Segment] = {}
+        self._lock = threading.Lock()
+
+    def _current(self, ts: float) -> _Segment:
+        month = month_key(ts)
+        seg = self._segment
+        if seg is None or seg.month != month:
+            if seg is not None:
+                seg.close()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            seg = self._others.pop(month, None) or _Segment(self.directory, month, self.limit)
+            self._segment = seg
+            self._purge(month)
+        return seg
+
+    def months(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return sorted(p.stem for p in self.directory.glob("*.log"))
+
+    def _purge(self, current: str) -> None:
+        old = [m for m in self.months() if m < current]
+        for month in old[: max(0, len(old) - (self.keep_months - 1))]:
+            if month in self._others:
+                self._others.pop(month).close()
+            for suffix in (".log", ".idx"):
+                try:
+                    (self.directory / f"{month}{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+            logger.info(f"Журнал сообщений: удалён сегмент {month}")
+
+    def append(self, user_id: int, text: str, ts: Optional[float] = None) -> None:
+        self.append_many([(user_id, text)], ts)
+
+    def append_many(self, items: Iterable[Tuple[int, str]], ts: Optional[float] = None) -> None:
+        """Несколько сообщений одной дозаписью (одно и то же время ts)."""
+        ts = int(datetime.now(timezone.utc).timestamp() if ts is None else ts)
+        with self._lock:
+            self._current(ts).write(((uid, ts, text) for uid, text in items), self.fsync)
+
+    def replace(self, user_id: int, messages: Iterable[Message], ts: Optional[float] = None) -> None:
+        """Заменить историю пользователя в текущем месяце на messages."""
+        ts = datetime.now(timezone.utc).timestamp() if ts is None else ts
+        items = [(user_id, None, "")]
+        items.extend((user_id, int(m_ts), text) for m_ts, text in messages)
+        with self._lock:
+            self._current(ts).write(items, self.fsync)
+
+    def oldest_kept(self, ts: Optional[float] = None) -> str:
+        """Самый старый месяц, который ещё хранится (keep_months, считая текущий)."""
+        month = month_key(datetime.now(timezone.utc).timestamp() if ts is None else ts)
+        year, mon = (int(x) for x in month.split("-"))
+        index = year * 12 + mon - 1 - (self.keep_months - 1)
+        return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+    def replace_month(self, month: str, histories: Dict[int, List[Message]]) -> None:
+        """
+        Заменить истории пользователей в сегменте month одной дозаписью
+        (перенос из migrate.py). Месяцы старше oldest_kept() не пишутся.
+        Сегменты прошлых месяцев остаются открытыми до close().
+        """
+        if month < self.oldest_kept():
+            return
+        items: List[Tuple[int, Optional[int], str]] = []
+        for user_id, messages in histories.items():
+            items.append((user_id, None, ""))
+            items.extend((user_id, int(ts), text) for ts, text in messages[-self.limit:])
+        with self._lock:
+            seg = self._segment
+            if seg is None or seg.month != month:
+                seg = self._others.get(month)
+                if seg is None:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    seg = self._others[month] = _Segment(self.directory, month, self.limit)
+            seg.write(items, self.fsync)
+
+    def read(self, user_id: int, month: Optional[str] = None, limit: Optional[int] = None) -> List[Message]:
+        limit = limit or self.limit
+        with self._lock:
+            if month is None:
+                return self._current(datetime.now(timezone.utc).timestamp()).read(user_id, limit)
+            if self._segment is not None and self._segment.month == month:
+                return self._segment.read(user_id, limit)
+            if month in self._others:
+                return self._others[month].read(user_id, limit)
+            if not (self.directory / f"{month}.log").exists():
+                return []
+            seg = _Segment(self.directory, month, limit)
+            try:
+                return seg.read(user_id, limit)
+            finally:
+                seg.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            for seg in self._others.values():
+                seg.close()
+            self._others.clear()
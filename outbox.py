@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+import storage
+from broadcast import Broadcaster, BroadcastStats
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """
+    Долговечная очередь ежедневных сообщений поверх таблицы outbox (storage.py).
+
+    Сообщение сначала записывается как (chat_id, date, kind) — повторная
+    постановка того же ключа игнорируется, поэтому одно и то же ежедневное
+    сообщение не уйдёт дважды, даже если рассылку запустили снова.
+    Отправка идёт пачками по batch_size: пачка одной транзакцией переводится
+    в sending, после прогона итоги (sent/failed) пишутся тоже одной
+    транзакцией — никакого коммита на каждое сообщение.
+
+    После падения при старте (resume) строки, застрявшие в sending,
+    возвращаются в pending и вместе с остальными pending дошлются — за
+    сегодня и за resume_days - 1 предыдущих дней. Доставку «не больше
+    одного раза» это не гарантирует: пачка, прерванная падением, может
+    частично уйти повторно, зато ничего не теряется.
+    """
+
+    def __init__(
+        self, broadcaster: Broadcaster, kind: str = "daily", batch_size: int = 500, resume_days: int = 2
+    ):
+        self.broadcaster = broadcaster
+        self.kind = kind
+        self.batch_size = batch_size
+        self.resume_days = resume_days
+        self._draining: Dict[str, asyncio.Task] = {}
+
+    def enqueue(self, date: str, items: Iterable[Tuple[int, str]]) -> int:
+        added = storage.outbox_enqueue(date, self.kind, items)
+        self.drain(date)
+        return added
+
+    def drain(self, date: str) -> asyncio.Task:
+        """Запустить (или вернуть уже идущую) отправку всего pending за дату."""
+        task = self._draining.get(date)
+        if task is None or task.done():
+            task = self._draining[date] = asyncio.create_task(self._drain(date))
+        return task
+
+    async def _drain(self, date: str) -> BroadcastStats:
+        total = BroadcastStats()
+        # новые сообщения, поставленные во время прогона, заберёт следующий claim
+        while True:
+            batch = storage.outbox_claim(date, self.kind, self.batch_size)
+            if not batch:
+                break
+            results: List[Tuple[int, str]] = []
+            try:
+                stats = await self.broadcaster.run(
+                    batch,
+                    on_result=lambda chat_id, ok: results.append((chat_id, "sent" if ok else "failed")),
+                )
+            finally:
+                # и при отмене на остановке — фиксируем то, что успели
+                storage.outbox_mark(date, self.kind, results)
+            total.sent += stats.sent
+            total.failed += stats.failed
+            total.throttled += stats.throttled
+            total.elapsed += stats.elapsed
+        if total.sent or total.failed:
+            logger.info(f"Outbox {self.kind} {date}: {total}")
+        return total
+
+    def resume(self, today: str) -> None:
+        since = (datetime.fromisoformat(today) - timedelta(days=self.resume_days - 1)).date().isoformat()
+        for day, pending in storage.outbox_requeue(self.kind, since).items():
+            logger.info(f"Outbox {self.kind} {day}: досылаем {pending} сообщений")
+            self.drain(day)
+
+    async def close(self) -> None:
+        for task in self._draining.values():
+            task.cancel()
+        for task in self._draining.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._draining.clear()
@@ -1,9 +1,18 @@
 # quotes.py — генерация/подбор цитаты без повторов
+import time
 import random
-from typing import Optional
-from settings import OPENAI_API_KEY
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from ai_client import get_ai_client
+from content import ZODIAC
+from generator import TZ
 from storage import init_quotes, get_quote, save_quote, recently_used_quotes
 
+logger = logging.getLogger(__name__)
+
 # Фолбэк-пул (разнообразный)
 FALLBACK_QUOTES = [
     ("Сенека", "Не потому мы мало решаемся, что вещи трудны; вещи трудны, потому что мы мало решаемся."),
@@ -23,68 +32,55 @@ FALLBACK_QUOTES = [
     ("Майя Энджелоу", "Мы не забываем, как люди заставили нас чувствовать."),
 ]
 
-# Инициализация OpenAI (опционально)
-_client = None
-if OPENAI_API_KEY:
-    try:
-        from openai import OpenAI
-        _client = OpenAI(api_key=OPENAI_API_KEY)
-    except Exception:
-        _client = None
-
 def _format_quote(text: str, author: Optional[str]) -> str:
     text = text.strip(" «»\"'")
     if author:
         return f"📜 Цитата дня: _{text}_ — **{author}**"
     return f"📜 Цитата дня: _{text}_"
 
-def _ai_make_quote(sign_ru: str, date_disp: str, rng_seed: str) -> Optional[tuple]:
+async def _ai_make_quote(sign_ru: str, date_disp: str, rng_seed: str) -> Optional[tuple]:
     """Просим модель короткую новую цитату (1 предложение) без клише."""
-    if not _client:
-        return None
-    try:
-        sys = ("Ты — куратор цитат. На русском. Придумай 1 лаконичную мотивирующую цитату (не банальную, без эмодзи), "
-               "подходящую для размышления на день. Не используй известные крылатые фразы.")
-        prompt = (f"Знак: {sign_ru}. Дата: {date_disp}. "
-                  "Стиль: умно, без пафоса, 8–18 слов, без кавычек. "
-                  "Верни строго в формате: ТЕКСТ — АВТОР. АВТОР может быть вымышленным лаконичным именем.")
-        _ = rng_seed
-        resp = _client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"system","content":sys}, {"role":"user","content":prompt}],
-            max_tokens=50, temperature=0.7
-        )
-        line = (resp.choices[0].message.content or "").strip()
-        if "—" in line:
-            text, author = [part.strip() for part in line.split("—", 1)]
-        elif "-" in line:
-            text, author = [part.strip() for part in line.split("-", 1)]
-        else:
-            text, author = line, None
-        if text:
-            return (text, author)
-    except Exception:
+    sys = ("Ты — куратор цитат. На русском. Придумай 1 лаконичную мотивирующую цитату (не банальную, без эмодзи), "
+           "подходящую для размышления на день. Не используй известные крылатые фразы.")
+    prompt = (f"Знак: {sign_ru}. Дата: {date_disp}. "
+              "Стиль: умно, без пафоса, 8–18 слов, без кавычек. "
+              "Верни строго в формате: ТЕКСТ — АВТОР. АВТОР может быть вымышленным лаконичным именем.")
+    _ = rng_seed
+    # фолбэк None — дальше сработает пул FALLBACK_QUOTES
+    line = await get_ai_client().complete(
+        [{"role":"system","content":sys}, {"role":"user","content":prompt}],
+        fallback=lambda: None,
+        max_tokens=50, temperature=0.7
+    )
+    if not line:
         return None
+    if "—" in line:
+        text, author = [part.strip() for part in line.split("—", 1)]
+    elif "-" in line:
+        text, author = [part.strip() for part in line.split("-", 1)]
+    else:
+        text, author = line, None
+    if text:
+        return (text, author)
     return None
 
-def get_or_create_daily_quote(date_key: str, sign_en: Optional[str], sign_ru: str, date_disp: str) -> str:
-    """Возвращает цитату для дня. Сначала кеш БД, иначе генерим (ИИ или фолбэк)
-       и сохраняем. Избегаем повторов за последние 60 дней."""
+async def _create_daily_quote(date_key: str, sign_en: Optional[str], sign_ru: str, date_disp: str) -> Tuple[str, str]:
+    """(цитата, источник): источник — 'cache', 'ai' или 'fallback'."""
     init_quotes()
     # кеш (сначала знаковая, иначе общая)
     row = get_quote(date_key, sign_en)
     if row:
-        return _format_quote(row["text"], row["author"])
+        return _format_quote(row["text"], row["author"]), "cache"
 
-    used = recently_used_quotes(60)
+    used = recently_used_quotes(60, today=date_key)
 
     # ИИ-попытка
-    text_author = _ai_make_quote(sign_ru, date_disp, rng_seed=f"{sign_en}|{date_key}")
+    text_author = await _ai_make_quote(sign_ru, date_disp, rng_seed=f"{sign_en}|{date_key}")
     if text_author:
         text, author = text_author
         if text not in used:
             save_quote(date_key, text, author, sign_en)
-            return _format_quote(text, author)
+            return _format_quote(text, author), "ai"
 
     # Фолбэк из пула
     rng = random.Random(f"quotes|{date_key}|{sign_en or 'ALL'}")
@@ -93,10 +89,93 @@ def get_or_create_daily_quote(date_key: str, sign_en: Optional[str], sign_ru: st
     for author, text in candidates:
         if text not in used:
             save_quote(date_key, text, author, sign_en)
-            return _format_quote(text, author)
+            return _format_quote(text, author), "fallback"
 
     # На крайний случай — первая
     author, text = candidates[0]
     save_quote(date_key, text, author, sign_en)
-    return _format_quote(text, author)
+    return _format_quote(text, author), "fallback"
+
+# одна генерация на (дата, знак), даже если первые запросы дня пришли разом
+_inflight: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+
+async def _daily_quote(date_key: str, sign_en: Optional[str], sign_ru: str, date_disp: str) -> Tuple[str, str]:
+    key = (date_key, sign_en)
+    fut = _inflight.get(key)
+    if fut is not None:
+        quote, _ = await asyncio.shield(fut)
+        return quote, "cache"
+    fut = _inflight[key] = asyncio.ensure_future(_create_daily_quote(date_key, sign_en, sign_ru, date_disp))
+    try:
+        return await asyncio.shield(fut)
+    finally:
+        if fut.done():
+            del _inflight[key]
+        else:
+            fut.add_done_callback(lambda _: _inflight.pop(key, None))
+
+async def get_or_create_daily_quote(date_key: str, sign_en: Optional[str], sign_ru: str, date_disp: str) -> str:
+    """Возвращает цитату для дня. Сначала кеш БД, иначе генерим (ИИ или фолбэк)
+       и сохраняем. Избегаем повторов за последние 60 дней."""
+    quote, _ = await _daily_quote(date_key, sign_en, sign_ru, date_disp)
+    return quote
+
+# === Предгенерация на день ===
+
+@dataclass
+class QuoteRunStats:
+    date_key: str
+    ai: int = 0
+    fallback: int = 0
+    cached: int = 0
+    failed: int = 0
+    latencies: List[float] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def fallback_rate(self) -> float:
+        generated = self.ai + self.fallback
+        return self.fallback / generated if generated else 0.0
+
+    def __str__(self) -> str:
+        lat = sorted(self.latencies) or [0.0]
+        return (
+            f"{self.date_key}: ai={self.ai} fallback={self.fallback} cached={self.cached} "
+            f"failed={self.failed} fallback_rate={self.fallback_rate:.0%} "
+            f"p50={lat[len(lat) // 2]:.2f}s max={lat[-1]:.2f}s time={self.elapsed:.1f}s"
+        )
+
+async def pregenerate_daily_quotes(day: Optional[date] = None, concurrency: int = 4) -> QuoteRunStats:
+    """
+    Создать цитаты дня для всех 12 знаков заранее (не больше concurrency
+    генераций одновременно), чтобы днём запросы только читали кеш БД.
+    """
+    day = day or datetime.now(TZ).date()
+    date_key = day.isoformat()
+    date_disp = day.strftime("%d.%m.%Y")
+    stats = QuoteRunStats(date_key)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(sign_en: str, label: str) -> None:
+        sign_ru = label.split(" ", 1)[-1]
+        async with sem:
+            started = time.monotonic()
+            try:
+                _, source = await _daily_quote(date_key, sign_en, sign_ru, date_disp)
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"Цитата дня для {sign_en}: {e}")
+                return
+            if source == "cache":
+                stats.cached += 1
+                return
+            stats.latencies.append(time.monotonic() - started)
+            if source == "ai":
+                stats.ai += 1
+            else:
+                stats.fallback += 1
 
+    started = time.monotonic()
+    await asyncio.gather(*(one(sign_en, label) for sign_en, label in ZODIAC.items()))
+    stats.elapsed = time.monotonic() - started
+    return stats
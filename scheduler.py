@@ -0,0 +1,177 @@
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta, time as dtime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytz
+
+from user_repo import minute_of_day
+
+logger = logging.getLogger(__name__)
+
+Users = Dict[str, Dict[str, Any]]
+Due = List[Tuple[str, Dict[str, Any]]]
+
+
+def _localize(tz, naive: datetime) -> datetime:
+    """Локальное время -> aware; переходы DST разбираем явно."""
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        # осенью час повторяется — берём первое наступление
+        return tz.localize(naive, is_dst=True)
+    except pytz.NonExistentTimeError:
+        # весной часа нет — сдвигаем вперёд (02:30 -> 03:30)
+        return tz.normalize(tz.localize(naive, is_dst=False))
+
+
+def next_fire(minute: int, tz, after: datetime) -> datetime:
+    """Ближайший момент строго после after (UTC), когда у tz на часах minute."""
+    hh, mm = divmod(minute, 60)
+    day = after.astimezone(tz).date()
+    for shift in range(3):
+        at = _localize(tz, datetime.combine(day + timedelta(days=shift), dtime(hh, mm)))
+        if at > after:
+            return at.astimezone(pytz.utc)
+    raise ValueError("next_fire: не нашли момент за 3 дня")
+
+
+def prev_fire(minute: int, tz, at: datetime) -> datetime:
+    """Последний момент не позже at (UTC), когда у tz на часах minute."""
+    hh, mm = divmod(minute, 60)
+    day = at.astimezone(tz).date()
+    for shift in range(3):
+        fired = _localize(tz, datetime.combine(day - timedelta(days=shift), dtime(hh, mm)))
+        if fired <= at:
+            return fired.astimezone(pytz.utc)
+    raise ValueError("prev_fire: не нашли момент за 3 дня")
+
+
+class ReminderScheduler:
+    """
+    Очередь с приоритетом «следующий момент срабатывания (UTC) -> пользователь».
+
+    Время напоминания (reminder_time) трактуется в таймзоне бота tz
+    и пересчитывается в UTC с учётом DST. Своей таймзоны у пользователя
+    в users_state.json нет — бот её нигде не спрашивает и не сохраняет.
+    Цикл спит ровно до ближайшего момента; изменения расписания будят его.
+    Устаревшие записи кучи не удаляются, а отбрасываются по номеру поколения.
+
+    При старте напоминания, пропущенные не раньше чем grace секунд назад,
+    отправляются сразу — если по метке sent_field видно, что их не было
+    (или метки нет вовсе).
+    """
+
+    def __init__(
+        self,
+        users: Callable[[], Users],
+        on_due: Callable[[Due], None],
+        tz,
+        grace: float = 3600,
+        sent_field: str = "reminder_sent_at",
+    ):
+        self.users = users
+        self.on_due = on_due
+        self.tz = tz
+        self.grace = grace
+        self.sent_field = sent_field
+        self._heap: List[Tuple[float, str, int]] = []
+        self._gen: Dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------------------------- расписание ----------------------------
+
+    def _push(self, key: str, at: datetime) -> None:
+        gen = self._gen.get(key, 0) + 1
+        self._gen[key] = gen
+        heapq.heappush(self._heap, (at.timestamp(), key, gen))
+
+    def schedule(self, key: str, user: Dict[str, Any], after: Optional[datetime] = None) -> None:
+        """(Пере)планировать пользователя после изменения reminder_time."""
+        key = str(key)
+        minute = minute_of_day(user.get("reminder_time"))
+        if minute is None:
+            self._gen.pop(key, None)
+            return
+        after = after or datetime.now(pytz.utc)
+        self._push(key, next_fire(minute, self.tz, after))
+        if self._wakeup is not None and self._heap[0][1] == key:
+            # новый момент раньше того, до которого спит цикл
+            self._wakeup.set()
+
+    def load(self, now: Optional[datetime] = None) -> Due:
+        """Построить очередь по всем пользователям; вернуть пропущенных в grace."""
+        now = now or datetime.now(pytz.utc)
+        self._heap = []
+        self._gen = {}
+        missed: Due = []
+        for key, user in self.users().items():
+            minute = minute_of_day(user.get("reminder_time"))
+            if minute is None:
+                continue
+            last = prev_fire(minute, self.tz, now)
+            # нет метки — напоминание ещё ни разу не уходило, значит, и сегодня тоже
+            sent_at = user.get(self.sent_field)
+            if (now - last).total_seconds() <= self.grace and (
+                sent_at is None or sent_at < last.timestamp()
+            ):
+                missed.append((key, user))
+            self._push(key, next_fire(minute, self.tz, now))
+        return missed
+
+    # ------------------------------- цикл -------------------------------
+
+    def _pop_due(self, now: float) -> Due:
+        users = self.users()
+        due: Due = []
+        while self._heap and self._heap[0][0] <= now:
+            ts, key, gen = heapq.heappop(self._heap)
+            if self._gen.get(key) != gen:
+                continue
+            user = users.get(key)
+            if user is None or minute_of_day(user.get("reminder_time")) is None:
+                self._gen.pop(key, None)
+                continue
+            due.append((key, user))
+            self.schedule(key, user, after=datetime.fromtimestamp(ts, pytz.utc))
+        return due
+
+    def _fire(self, due: Due) -> None:
+        if not due:
+            return
+        try:
+            self.on_due(due)
+        except Exception as e:
+            logger.error(f"Ошибка обработки напоминаний: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._fire(self._pop_due(time.time()))
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        missed = self.load()
+        if missed:
+            logger.info(f"Догоняем пропущенные напоминания: {len(missed)}")
+            self._fire(missed)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
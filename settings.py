@@ -1,10 +1,26 @@
 import os
 from dotenv import load_dotenv
 load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-HOST = "0.0.0.0"
-PORT = 8080
-WEBHOOK_PATH = "/telegram/webhook"
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("BOT_TOKEN", "")
+# polling — executor.start_polling, webhook — aiohttp-сервер на HOST:PORT
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
 # Для ngrok будет вида: https://<subdomain>.ngrok-free.app
 PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+# Свой адрес Bot API (локальный сервер или стенд для бенчмарка), пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+# ИИ (ai_client.py): без ключа всё работает на локальных шаблонах
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# OpenAI-совместимый адрес (локальная заглушка: python bench.py ai), пусто — api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "").rstrip("/")
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", "10"))        # сек на запрос вместе с очередью
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "8"))     # одновременных запросов
+AI_SLOW_CALL = float(os.getenv("AI_SLOW_CALL", "6"))       # медленнее — считается неудачей
+# Кеш ответов ИИ (ai_cache.py); AI_CACHE_FILE пусто — только в памяти
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "1000"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", str(36 * 3600)))
+AI_CACHE_FILE = os.getenv("AI_CACHE_FILE", "ai_cache.json")
 assert BOT_TOKEN, "BOT_TOKEN пустой!"
@@ -1,19 +1,72 @@
 import sqlite3
 import os
+import threading
 from contextlib import contextmanager
-from datetime import datetime
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import pytz
 
 DB_PATH = os.getenv("ASTROBOT_DB", os.path.join(os.path.dirname(__file__), "astrobot.db"))
 
+# Одно долгоживущее соединение на процесс. Доступ сериализуем RLock'ом,
+# вложенные _db() (например, внутри batch()) работают в одной транзакции,
+# коммит — при выходе из самого внешнего блока.
+_conn = None
+_lock = threading.RLock()
+_depth = 0
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 @contextmanager
 def _db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.commit()
-        conn.close()
+    global _conn, _depth
+    with _lock:
+        if _conn is None:
+            _conn = _connect()
+        _depth += 1
+        ok = False
+        try:
+            yield _conn
+            ok = True
+        finally:
+            # finally, а не except Exception: KeyboardInterrupt/CancelledError
+            # тоже должны вернуть глубину, иначе коммитов больше не будет
+            _depth -= 1
+            if _depth == 0:
+                if ok:
+                    _conn.commit()
+                else:
+                    _conn.rollback()
+
+@contextmanager
+def batch():
+    """Все вызовы внутри блока — одна транзакция и один коммит."""
+    with _db() as db:
+        yield db
+
+def close_db():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.commit()
+            _conn.close()
+            _conn = None
 
 def init_db():
     with _db() as db:
@@ -29,27 +82,121 @@ def init_db():
         )""")
         # добивка недостающих колонок (гладкие миграции)
         cols = {r["name"] for r in db.execute("PRAGMA table_info(users)")}
+        if "sign"       not in cols: db.execute("ALTER TABLE users ADD COLUMN sign TEXT")
         if "daily_on"   not in cols: db.execute("ALTER TABLE users ADD COLUMN daily_on INTEGER DEFAULT 0")
         if "daily_time" not in cols: db.execute("ALTER TABLE users ADD COLUMN daily_time TEXT DEFAULT '09:00'")
         if "tz"         not in cols: db.execute("ALTER TABLE users ADD COLUMN tz TEXT DEFAULT 'Europe/Madrid'")
         if "created_at" not in cols: db.execute("ALTER TABLE users ADD COLUMN created_at TEXT")
         if "updated_at" not in cols: db.execute("ALTER TABLE users ADD COLUMN updated_at TEXT")
+        if "lang"       not in cols: db.execute("ALTER TABLE users ADD COLUMN lang TEXT")
+        if "last_month" not in cols: db.execute("ALTER TABLE users ADD COLUMN last_month TEXT")
+        # корзины для выборки «кому отправлять сейчас»:
+        # local_minute — daily_time в минутах суток, utc_offset — смещение tz
+        # (в минутах), по которому посчитан utc_minute; NULL — пересчитать
+        if "local_minute" not in cols:
+            db.execute("ALTER TABLE users ADD COLUMN local_minute INTEGER DEFAULT 540")
+            db.execute("""
+            UPDATE users SET local_minute =
+                CAST(substr(daily_time, 1, instr(daily_time, ':') - 1) AS INTEGER) * 60
+                + CAST(substr(daily_time, instr(daily_time, ':') + 1) AS INTEGER)
+            WHERE daily_time LIKE '%:%'
+            """)
+        if "utc_offset" not in cols: db.execute("ALTER TABLE users ADD COLUMN utc_offset INTEGER")
+        if "utc_minute" not in cols: db.execute("ALTER TABLE users ADD COLUMN utc_minute INTEGER")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_due ON users(daily_on, utc_minute)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_offset_tz ON users(utc_offset, tz)")
+
+        # остальное состояние, которое раньше жило в JSON-файлах (см. migrate.py)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS tarot_draws (
+            user_id      INTEGER PRIMARY KEY,
+            date         TEXT NOT NULL,
+            card_id      TEXT NOT NULL
+        )""")
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS sign_patterns (
+            sign         TEXT NOT NULL,
+            date         TEXT NOT NULL,
+            pattern      TEXT NOT NULL,
+            PRIMARY KEY (sign, date)
+        )""")
+        # scope: 'user' — анти-повтор store.py, 'sign' — history.py
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS template_history (
+            scope        TEXT NOT NULL,
+            owner        TEXT NOT NULL,
+            used_at      TEXT NOT NULL,
+            template_id  TEXT NOT NULL,
+            PRIMARY KEY (scope, owner, used_at, template_id)
+        )""")
+        # только промежуточно для migrate.py: сообщения живут в msglog.py
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS user_messages (
+            user_id      INTEGER NOT NULL,
+            seq          INTEGER NOT NULL,
+            ts           TEXT,
+            text         TEXT,
+            PRIMARY KEY (user_id, seq)
+        )""")
+        # исходящие ежедневные сообщения: одна строка на (чат, дата, вид),
+        # status: pending -> sending -> sent | failed (см. outbox.py)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            chat_id      INTEGER NOT NULL,
+            date         TEXT NOT NULL,
+            kind         TEXT NOT NULL,
+            status       TEXT NOT NULL DEFAULT 'pending',
+            text         TEXT,
+            updated_at   TEXT,
+            PRIMARY KEY (chat_id, date, kind)
+        )""")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(date, kind, status)")
+    init_quotes()
 
 def _now_iso():
     return datetime.utcnow().isoformat(timespec="seconds")
 
-def upsert_user(user_id: int):
+# поля users, которые можно менять через _upsert / apply_user_changes
+USER_FIELDS = ("sign", "daily_on", "daily_time", "tz", "lang", "last_month")
+
+def _local_minute(hhmm: str) -> int:
+    hour, minute = str(hhmm).split(":")
+    return int(hour) * 60 + int(minute)
+
+def _expand(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверить поля и добавить производные колонки."""
+    for f in fields:
+        if f not in USER_FIELDS:
+            raise ValueError(f"Неизвестное поле users: {f}")
+    if "daily_time" in fields:
+        fields = {**fields, "local_minute": _local_minute(fields["daily_time"])}
+    return fields
+
+@lru_cache(maxsize=None)
+def _upsert_sql(fields: Tuple[str, ...]) -> str:
+    cols = ("user_id",) + fields + ("created_at", "updated_at")
+    updates = [f"{f}=excluded.{f}" for f in fields] + ["updated_at=excluded.updated_at"]
+    if "local_minute" in fields or "tz" in fields:
+        # корзину utc_minute пересчитает _sync_buckets()
+        updates.append("utc_offset=NULL")
+    return (
+        f"INSERT INTO users ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+        f"ON CONFLICT(user_id) DO UPDATE SET {', '.join(updates)}"
+    )
+
+def _upsert(user_id: int, **fields):
+    """Создать пользователя или обновить поля — одним запросом."""
+    fields = _expand(fields)
+    names = tuple(fields)
+    now = _now_iso()
     with _db() as db:
-        db.execute("""
-        INSERT INTO users (user_id, created_at, updated_at)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET updated_at=excluded.updated_at
-        """, (user_id, _now_iso(), _now_iso()))
+        db.execute(_upsert_sql(names), (user_id, *fields.values(), now, now))
+
+def upsert_user(user_id: int):
+    _upsert(user_id)
 
 def set_sign(user_id: int, sign: str):
-    upsert_user(user_id)
-    with _db() as db:
-        db.execute("UPDATE users SET sign=?, updated_at=? WHERE user_id=?", (sign, _now_iso(), user_id))
+    _upsert(user_id, sign=sign)
 
 def get_sign(user_id: int):
     with _db() as db:
@@ -57,14 +204,10 @@ def get_sign(user_id: int):
         return row["sign"] if row else None
 
 def set_daily(user_id: int, enabled: bool, time_hhmm: str = None):
-    upsert_user(user_id)
-    with _db() as db:
-        if time_hhmm is not None:
-            db.execute("UPDATE users SET daily_on=?, daily_time=?, updated_at=? WHERE user_id=?",
-                       (1 if enabled else 0, time_hhmm, _now_iso(), user_id))
-        else:
-            db.execute("UPDATE users SET daily_on=?, updated_at=? WHERE user_id=?",
-                       (1 if enabled else 0, _now_iso(), user_id))
+    if time_hhmm is not None:
+        _upsert(user_id, daily_on=1 if enabled else 0, daily_time=time_hhmm)
+    else:
+        _upsert(user_id, daily_on=1 if enabled else 0)
 
 def get_daily_settings(user_id: int):
     with _db() as db:
@@ -74,9 +217,28 @@ def get_daily_settings(user_id: int):
         return {"daily_on": int(row["daily_on"] or 0), "daily_time": row["daily_time"], "tz": row["tz"]}
 
 def set_tz(user_id: int, tz: str):
-    upsert_user(user_id)
+    _upsert(user_id, tz=tz)
+
+def apply_user_changes(changes: Iterable[Tuple[int, Dict[str, Any]]]) -> int:
+    """
+    Пакетно применить изменения [(user_id, {"sign": ..., "daily_on": ...}), ...]
+    в одной транзакции. Изменения с одинаковым набором полей уходят одним
+    executemany. Возвращает число применённых изменений.
+    """
+    groups: Dict[Tuple[str, ...], list] = {}
+    now = _now_iso()
+    for user_id, fields in changes:
+        fields = _expand(fields)
+        names = tuple(sorted(fields))
+        groups.setdefault(names, []).append(
+            (user_id, *(fields[f] for f in names), now, now)
+        )
+    total = 0
     with _db() as db:
-        db.execute("UPDATE users SET tz=?, updated_at=? WHERE user_id=?", (tz, _now_iso(), user_id))
+        for names, rows in groups.items():
+            db.executemany(_upsert_sql(names), rows)
+            total += len(rows)
+    return total
 
 def get_user_row(user_id: int):
     with _db() as db:
@@ -99,6 +261,231 @@ def list_daily_users():
     with _db() as db:
         rows = db.execute("SELECT user_id, daily_time, tz FROM users WHERE daily_on=1").fetchall()
         return [{"user_id": r["user_id"], "daily_time": r["daily_time"], "tz": r["tz"]} for r in rows]
+
+# --- Кому отправлять сейчас (по UTC-корзинам) ---
+# utc_minute = (local_minute - смещение tz) mod 1440. Смещение меняется при
+# переходе на летнее/зимнее время, поэтому держим в памяти, с каким смещением
+# посчитаны корзины каждой tz, и пересчитываем tz целиком только когда оно
+# поменялось. Изменённые пользователи (utc_offset IS NULL) находятся
+# по префиксу индекса idx_users_offset_tz.
+
+_tz_offsets: Optional[Dict[str, Set[int]]] = None
+_tz_cache: Dict[str, Any] = {}
+
+def _offset_minutes(tz_name: str, instant: datetime) -> int:
+    tz = _tz_cache.get(tz_name)
+    if tz is None:
+        try:
+            tz = pytz.timezone(tz_name)
+        except pytz.UnknownTimeZoneError:
+            tz = pytz.timezone("Europe/Madrid")
+        _tz_cache[tz_name] = tz
+    return int(instant.astimezone(tz).utcoffset().total_seconds() // 60)
+
+def _sync_buckets(db, instant: datetime) -> None:
+    global _tz_offsets
+    if _tz_offsets is None:
+        _tz_offsets = {}
+        for r in db.execute("SELECT DISTINCT tz, utc_offset FROM users WHERE utc_offset IS NOT NULL"):
+            _tz_offsets.setdefault(r["tz"], set()).add(r["utc_offset"])
+    stale = {r["tz"] for r in db.execute("SELECT DISTINCT tz FROM users WHERE utc_offset IS NULL")}
+    bucket_sql = (
+        "UPDATE users SET utc_offset=?, utc_minute=((local_minute - ?) % 1440 + 1440) % 1440 "
+        "WHERE tz IS ? AND utc_offset "
+    )
+    for tz_name in set(_tz_offsets) | stale:
+        off = _offset_minutes(tz_name or "Europe/Madrid", instant)
+        for old in _tz_offsets.get(tz_name, set()) - {off}:
+            db.execute(bucket_sql + "= ?", (off, off, tz_name, old))
+        if tz_name in stale:
+            db.execute(bucket_sql + "IS NULL", (off, off, tz_name))
+        _tz_offsets[tz_name] = {off}
+
+def list_due_users(instant: datetime = None) -> List[Dict[str, Any]]:
+    """
+    Подписчики, у которых в их собственной tz сейчас наступает daily_time.
+    instant — момент в UTC (aware или naive UTC), по умолчанию сейчас.
+    """
+    if instant is None:
+        instant = datetime.now(timezone.utc)
+    elif instant.tzinfo is None:
+        instant = instant.replace(tzinfo=timezone.utc)
+    instant = instant.astimezone(timezone.utc)
+    minute = instant.hour * 60 + instant.minute
+    with _db() as db:
+        _sync_buckets(db, instant)
+        rows = db.execute(
+            "SELECT user_id, sign, daily_time, tz FROM users WHERE daily_on=1 AND utc_minute=?",
+            (minute,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+# === Outbox ежедневной рассылки ===
+
+def outbox_enqueue(date: str, kind: str, items: Iterable[Tuple[int, str]]) -> int:
+    """
+    Записать сообщения к отправке одной транзакцией. Уже существующие
+    (chat_id, date, kind) не трогаются — второй раз то же сообщение
+    в очередь не попадёт. Возвращает число новых строк.
+    """
+    now = _now_iso()
+    rows = [(chat_id, date, kind, text, now) for chat_id, text in items]
+    with _db() as db:
+        before = db.total_changes
+        db.executemany(
+            "INSERT OR IGNORE INTO outbox (chat_id, date, kind, text, updated_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        return db.total_changes - before
+
+def outbox_claim(date: str, kind: str, limit: int) -> List[Tuple[int, str]]:
+    """Перевести до limit строк pending -> sending и вернуть их (chat_id, text)."""
+    with _db() as db:
+        rows = db.execute(
+            "SELECT chat_id, text FROM outbox WHERE date=? AND kind=? AND status='pending' LIMIT ?",
+            (date, kind, limit),
+        ).fetchall()
+        now = _now_iso()
+        db.executemany(
+            "UPDATE outbox SET status='sending', updated_at=? WHERE chat_id=? AND date=? AND kind=?",
+            [(now, r["chat_id"], date, kind) for r in rows],
+        )
+        return [(r["chat_id"], r["text"]) for r in rows]
+
+def outbox_mark(date: str, kind: str, statuses: Iterable[Tuple[int, str]]) -> None:
+    """Пакетно проставить итог [(chat_id, 'sent'|'failed'), ...]."""
+    now = _now_iso()
+    with _db() as db:
+        db.executemany(
+            "UPDATE outbox SET status=?, updated_at=? WHERE chat_id=? AND date=? AND kind=?",
+            [(status, now, chat_id, date, kind) for chat_id, status in statuses],
+        )
+
+def outbox_requeue(kind: str, since: str) -> Dict[str, int]:
+    """
+    После перезапуска: застрявшие в sending строки с даты since вернуть
+    в pending. Возвращает {дата: сколько теперь pending} по всем датам
+    с неотправленным.
+    """
+    now = _now_iso()
+    with _db() as db:
+        db.execute(
+            "UPDATE outbox SET status='pending', updated_at=? WHERE kind=? AND status='sending' AND date>=?",
+            (now, kind, since),
+        )
+        rows = db.execute(
+            "SELECT date, COUNT(*) AS n FROM outbox WHERE kind=? AND status='pending' AND date>=? "
+            "GROUP BY date ORDER BY date",
+            (kind, since),
+        ).fetchall()
+        return {r["date"]: r["n"] for r in rows}
+
+def outbox_counts(date: str, kind: str) -> Dict[str, int]:
+    with _db() as db:
+        rows = db.execute(
+            "SELECT status, COUNT(*) AS n FROM outbox WHERE date=? AND kind=? GROUP BY status",
+            (date, kind),
+        ).fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+# === Цитаты дня (quotes.py) ===
+# sign = '' — общая цитата дня. Недавно использованные тексты держим в памяти:
+# по дате -> набор текстов и общий счётчик, новые записи докладываются
+# на лету, старые даты выбрасываются по мере сдвига окна.
+
+_quotes_ready = False
+_recent_by_date: Dict[str, Set[str]] = {}
+_recent_counts: Counter = Counter()
+_recent_days: Optional[int] = None
+
+def init_quotes():
+    """Создать таблицу цитат (один раз на процесс)."""
+    global _quotes_ready
+    if _quotes_ready:
+        return
+    with _db() as db:
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS quotes (
+            date_key     TEXT NOT NULL,
+            sign         TEXT NOT NULL DEFAULT '',
+            text         TEXT NOT NULL,
+            author       TEXT,
+            created_at   TEXT
+        )""")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_quotes_date_sign ON quotes(date_key, sign)")
+    _quotes_ready = True
+
+def get_quote(date_key: str, sign: Optional[str] = None):
+    """Цитата на дату: сначала для знака, иначе общая. Row(text, author) или None."""
+    with _db() as db:
+        return db.execute(
+            "SELECT text, author FROM quotes WHERE date_key=? AND sign IN (?, '') "
+            "ORDER BY sign = '' LIMIT 1",
+            (date_key, sign or ""),
+        ).fetchone()
+
+def _remember_quote(date_key: str, text: str) -> None:
+    texts = _recent_by_date.setdefault(date_key, set())
+    if text not in texts:
+        texts.add(text)
+        _recent_counts[text] += 1
+
+def save_quote(date_key: str, text: str, author: Optional[str] = None, sign: Optional[str] = None):
+    with _db() as db:
+        old = db.execute(
+            "SELECT text FROM quotes WHERE date_key=? AND sign=?", (date_key, sign or "")
+        ).fetchone()
+        db.execute(
+            "INSERT INTO quotes (date_key, sign, text, author, created_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(date_key, sign) DO UPDATE SET "
+            "text=excluded.text, author=excluded.author, created_at=excluded.created_at",
+            (date_key, sign or "", text, author, _now_iso()),
+        )
+        if _recent_days is not None:
+            if old and old["text"] != text:
+                _forget_quote(date_key, old["text"])
+            _remember_quote(date_key, text)
+
+def _forget_quote(date_key: str, text: str) -> None:
+    # на эту дату тот же текст мог быть сохранён и для другого знака
+    with _db() as db:
+        still_used = db.execute(
+            "SELECT 1 FROM quotes WHERE date_key=? AND text=? LIMIT 1", (date_key, text)
+        ).fetchone()
+    if still_used:
+        return
+    texts = _recent_by_date.get(date_key)
+    if texts and text in texts:
+        texts.discard(text)
+        _recent_counts[text] -= 1
+        if _recent_counts[text] <= 0:
+            del _recent_counts[text]
+
+def recently_used_quotes(days: int = 60, *, today: str) -> frozenset:
+    """
+    Тексты цитат за последние days дней до today (снимок — окно может
+    сдвинуться, пока вызывающий ждёт ИИ). today обязателен: это date_key
+    в TZ бота, как у самих цитат, а часы сервера здесь не подходят.
+    Первый вызов читает окно из БД, дальше окно сдвигается в памяти.
+    """
+    global _recent_days
+    cutoff = (date.fromisoformat(today) - timedelta(days=days)).isoformat()
+    with _lock:
+        if _recent_days != days:
+            _recent_by_date.clear()
+            _recent_counts.clear()
+            with _db() as db:
+                for row in db.execute(
+                    "SELECT date_key, text FROM quotes WHERE date_key >= ?", (cutoff,)
+                ):
+                    _remember_quote(row["date_key"], row["text"])
+            _recent_days = days
+        for date_key in [d for d in _recent_by_date if d < cutoff]:
+            for text in _recent_by_date.pop(date_key):
+                _recent_counts[text] -= 1
+                if _recent_counts[text] <= 0:
+                    del _recent_counts[text]
+        return frozenset(_recent_counts)
+
 # === Совместимость со старым bot.py ===
 
 def get_daily(user_id: int):
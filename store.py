@@ -1,86 +1,288 @@
 # store.py
-import json, os
-from datetime import datetime, timedelta
+# Данные пользователя живут построчно в SQLite (storage.py): знак и last_month —
+# в users, анти-повтор — в template_history (scope='user'). Журнал сообщений —
+# помесячные append-only файлы msglog.py в MESSAGES_DIR рядом с базой.
+# Изменение одного пользователя трогает только его строки.
+# Старый storage.json (и строки user_messages) переносится командой `python migrate.py`.
+import os
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, List, Tuple
 from content import ZODIAC
+from msglog import MessageLog
+import storage
 
-PATH = "storage.json"
+USED_LIMIT = 200
+MESSAGES_LIMIT = 500
+# сколько пользователей держать с кольцами анти-повтора в памяти
+RING_CACHE_USERS = 5000
+MESSAGES_DIR = os.getenv("ASTROBOT_MESSAGES", os.path.join(os.path.dirname(storage.DB_PATH), "messages"))
 
-def _load() -> Dict[str, Any]:
-    if not os.path.exists(PATH):
-        return {"users": {}, "monthly": {}}
-    with open(PATH, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-            if "users" not in data:  # защита от повреждения
-                data["users"] = {}
-            if "monthly" not in data:
-                data["monthly"] = {}
-            return data
-        except Exception:
-            return {"users": {}, "monthly": {}}
-
-def _save(data: Dict[str, Any]) -> None:
-    tmp = PATH + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, PATH)
+_ready = False
+_log = None
+
+def _ensure():
+    global _ready
+    if not _ready:
+        storage.init_db()
+        _ready = True
+
+def _db():
+    _ensure()
+    return storage.batch()
+
+def messages_log() -> MessageLog:
+    global _log
+    if _log is None:
+        _log = MessageLog(MESSAGES_DIR, limit=MESSAGES_LIMIT)
+    return _log
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")
+
+def _epoch(iso: str) -> int:
+    return int(datetime.fromisoformat(iso).replace(tzinfo=timezone.utc).timestamp())
+
+# used_at в template_history — с микросекундами: ключ (scope, owner, used_at,
+# template_id), и два выбора одного шаблона за одну секунду не должны слиться
+def _used_at(stamp: float) -> str:
+    return datetime.fromtimestamp(stamp, timezone.utc).replace(tzinfo=None).isoformat(timespec="microseconds")
+
+def _distinct_used(used: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """(used_at, id) из записей used; совпавшие пары разводим на микросекунду."""
+    out = []
+    taken = set()
+    for x in used:
+        ts, tid = x["ts"], str(x["id"])
+        stamp = datetime.fromisoformat(ts)
+        while (ts, tid) in taken:
+            stamp += timedelta(microseconds=1)
+            ts = stamp.isoformat(timespec="microseconds")
+        taken.add((ts, tid))
+        out.append((ts, tid))
+    return out
 
 def get_user(user_id: int) -> Dict[str, Any]:
-    data = _load()
-    key = str(user_id)
-    u = data["users"].get(key)
-    if not u:
-        u = {"used": [], "last_month": None, "messages": [], "profile": {}}
-        data["users"][key] = u
-        _save(data)
-    else:
-        # миграция старых записей без profile
-        if "profile" not in u:
-            u["profile"] = {}
-            data["users"][key] = u
-            _save(data)
-    return u
+    """Запись пользователя в прежнем формате (только чтение, ничего не создаёт)."""
+    with _db() as db:
+        row = db.execute("SELECT sign, last_month FROM users WHERE user_id=?", (user_id,)).fetchone()
+        used = db.execute(
+            "SELECT template_id, used_at FROM template_history "
+            "WHERE scope='user' AND owner=? ORDER BY used_at DESC LIMIT ?",
+            (str(user_id), USED_LIMIT),
+        ).fetchall()[::-1]
+    messages = messages_log().read(user_id)
+    profile = {}
+    if row and row["sign"] in ZODIAC:
+        profile["sign"] = row["sign"]
+    return {
+        "used": [{"id": r["template_id"], "ts": r["used_at"]} for r in used],
+        "last_month": row["last_month"] if row else None,
+        "messages": [{"ts": _iso(ts), "text": text} for ts, text in messages],
+        "profile": profile,
+    }
 
 def put_user(user_id: int, user: Dict[str, Any]) -> None:
-    data = _load()
-    data["users"][str(user_id)] = user
-    _save(data)
+    """Заменить запись одного пользователя целиком (одной транзакцией)."""
+    fields = {"last_month": user.get("last_month")}
+    sign = (user.get("profile") or {}).get("sign")
+    if sign in ZODIAC:
+        fields["sign"] = sign
+    owner = str(user_id)
+    _rings.pop(user_id, None)
+    with _db() as db:
+        storage.apply_user_changes([(user_id, fields)])
+        db.execute("DELETE FROM template_history WHERE scope='user' AND owner=?", (owner,))
+        db.executemany(
+            "INSERT INTO template_history (scope, owner, used_at, template_id) VALUES ('user', ?, ?, ?)",
+            [(owner, ts, tid) for ts, tid in _distinct_used((user.get("used") or [])[-USED_LIMIT:])],
+        )
+    now = int(time.time())
+    messages_log().replace(
+        user_id,
+        [
+            (_epoch(m["ts"]) if m.get("ts") else now, m.get("text") or "")
+            for m in (user.get("messages") or [])[-MESSAGES_LIMIT:]
+        ],
+    )
 
 # --- Анти-повтор ---
+# В памяти у пользователя — кольцо на USED_LIMIT троек (код шаблона, epoch-секунды, rowid)
+# в двух массивах array: запись O(1), проверка идёт от новых к старым
+# без разбора дат и сортировки. template_history — долговременная копия,
+# из неё кольцо поднимается один раз при первом обращении.
+
+_template_codes: Dict[str, int] = {}
+_template_ids: List[str] = []
+
+def _template_code(template_id: str) -> int:
+    code = _template_codes.get(template_id)
+    if code is None:
+        code = _template_codes[template_id] = len(_template_ids)
+        _template_ids.append(template_id)
+    return code
+
+class _UsageRing:
+    __slots__ = ("codes", "stamps", "rowids", "head", "size")
+
+    def __init__(self, capacity: int = USED_LIMIT):
+        self.codes = array("I", bytes(4 * capacity))
+        self.stamps = array("q", bytes(8 * capacity))
+        # rowid строки template_history — чтобы удалить ровно вытесненную
+        self.rowids = array("q", bytes(8 * capacity))
+        self.head = 0  # куда пишем следующую запись
+        self.size = 0
+
+    def append(self, code: int, stamp: int, rowid: int) -> int:
+        """Записать пару; вернуть rowid вытесненной записи (0 — никого)."""
+        evicted = self.rowids[self.head] if self.size == len(self.codes) else 0
+        self.codes[self.head] = code
+        self.stamps[self.head] = stamp
+        self.rowids[self.head] = rowid
+        self.head = (self.head + 1) % len(self.codes)
+        if self.size < len(self.codes):
+            self.size += 1
+        return evicted
+
+    def blocked(self, last_n: int, since: int) -> set:
+        """Коды из последних last_n записей и всех записей не старше since."""
+        out = set()
+        cap = len(self.codes)
+        i = self.head
+        for k in range(self.size):
+            i = (i - 1) % cap
+            if k >= last_n and self.stamps[i] < since:
+                break
+            out.add(self.codes[i])
+        return out
+
+_rings: "OrderedDict[int, _UsageRing]" = OrderedDict()
+
+def _ring(user_id: int) -> _UsageRing:
+    ring = _rings.get(user_id)
+    if ring is not None:
+        _rings.move_to_end(user_id)
+        return ring
+    ring = _UsageRing()
+    owner = str(user_id)
+    with _db() as db:
+        rows = db.execute(
+            "SELECT rowid, template_id, used_at FROM template_history "
+            "WHERE scope='user' AND owner=? ORDER BY used_at DESC LIMIT ?",
+            (owner, USED_LIMIT),
+        ).fetchall()
+        if len(rows) == USED_LIMIT:
+            # всё старше кольца (остатки прежних версий) убираем один раз
+            # при подъёме, дальше _remember удаляет по одной строке
+            db.execute(
+                "DELETE FROM template_history WHERE scope='user' AND owner=? AND used_at < ?",
+                (owner, rows[-1]["used_at"]),
+            )
+    for r in reversed(rows):
+        ring.append(_template_code(r["template_id"]), _epoch(r["used_at"]), r["rowid"])
+    _rings[user_id] = ring
+    if len(_rings) > RING_CACHE_USERS:
+        _rings.popitem(last=False)
+    return ring
+
+def _remember(db, user_id: int, template_id: str) -> None:
+    now = time.time()
+    ring = _ring(user_id)
+    owner = str(user_id)
+    cur = db.execute(
+        "INSERT INTO template_history (scope, owner, used_at, template_id) VALUES ('user', ?, ?, ?)",
+        (owner, _used_at(now), template_id),
+    )
+    evicted = ring.append(_template_code(template_id), int(now), cur.lastrowid)
+    if evicted:
+        # в той же транзакции держим в базе ровно USED_LIMIT последних —
+        # столько же, сколько в кольце: удаляем одну вытесненную строку.
+        # owner в условии — на случай, если rowid уже переиспользован
+        db.execute(
+            "DELETE FROM template_history WHERE rowid=? AND scope='user' AND owner=?",
+            (evicted, owner),
+        )
+
+# --- Сессия пользователя: одно чтение, одна транзакция ---
+
+class UserSession:
+    """
+    Работа с одним пользователем внутри одной транзакции: last_month
+    читается одним запросом при первой надобности, дальше все шаги работают
+    с ним в памяти, коммит — один, при выходе из store.session(). Сообщения
+    копятся в pending и дописываются в журнал уже после коммита.
+    """
+
+    def __init__(self, db, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.pending: List[str] = []
+        self._loaded = False
+        self._last_month = None
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        row = self.db.execute("SELECT last_month FROM users WHERE user_id=?", (self.user_id,)).fetchone()
+        self._last_month = row["last_month"] if row else None
+        self._loaded = True
+
+    def monthly_reset(self) -> None:
+        # сами сообщения чистить не нужно: новый месяц — новый файл журнала
+        self._load()
+        cur = datetime.utcnow().strftime("%Y-%m")
+        if self._last_month != cur:
+            storage.apply_user_changes([(self.user_id, {"last_month": cur})])
+            self._last_month = cur
+
+    def filter_allowed(self, templates: List[Tuple[str, str]], N: int = 6, days: int = 14):
+        return filter_allowed(self.user_id, templates, N, days)
+
+    def remember_template(self, template_id: str) -> None:
+        _remember(self.db, self.user_id, template_id)
+
+    def append_message(self, text: str) -> None:
+        self.monthly_reset()
+        self.pending.append(text[:500])
+
+@contextmanager
+def session(user_id: int):
+    """with store.session(uid) as s: ... — всё внутри — одна транзакция."""
+    with _db() as db:
+        s = UserSession(db, user_id)
+        try:
+            yield s
+        except BaseException:
+            # транзакция откатится — кольцо в памяти тоже перечитаем
+            _rings.pop(user_id, None)
+            raise
+    if s.pending:
+        messages_log().append_many((user_id, text) for text in s.pending)
 
 def filter_allowed(user_id: int, templates: List[Tuple[str, str]], N: int = 6, days: int = 14):
-    u = get_user(user_id)
-    recent = sorted(u["used"], key=lambda x: x["ts"], reverse=True)[:N]
-    recent_ids = [x["id"] for x in recent]
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    blocked_ids = set(recent_ids + [x["id"] for x in u["used"] if datetime.fromisoformat(x["ts"]) >= cutoff])
-    return [t for t in templates if t[0] not in blocked_ids]
+    blocked = _ring(user_id).blocked(N, int(time.time()) - days * 86400)
+    return [t for t in templates if _template_code(t[0]) not in blocked]
 
 def remember_template(user_id: int, template_id: str):
-    u = get_user(user_id)
-    u["used"].append({"id": template_id, "ts": datetime.utcnow().isoformat(timespec="seconds")})
-    if len(u["used"]) > 200:
-        u["used"] = u["used"][-200:]
-    put_user(user_id, u)
+    with _db() as db:
+        try:
+            _remember(db, user_id, template_id)
+        except BaseException:
+            _rings.pop(user_id, None)
+            raise
 
 # --- Помесячная очистка и логи сообщений ---
 
 def monthly_reset_messages(user_id: int):
-    u = get_user(user_id)
-    cur = datetime.utcnow().strftime("%Y-%m")
-    if u.get("last_month") != cur:
-        u["messages"] = []
-        u["last_month"] = cur
-        put_user(user_id, u)
+    with session(user_id) as s:
+        s.monthly_reset()
 
 def append_message(user_id: int, text: str):
-    u = get_user(user_id)
-    monthly_reset_messages(user_id)
-    u["messages"].append({"ts": datetime.utcnow().isoformat(timespec="seconds"), "text": text[:500]})
-    if len(u["messages"]) > 500:
-        u["messages"] = u["messages"][-500:]
-    put_user(user_id, u)
+    with session(user_id) as s:
+        s.append_message(text)
 
 # --- Профиль пользователя: знак зодиака ---
 
@@ -89,8 +291,8 @@ def get_user_sign(user_id: int):
     Возвращает (code, label) или (None, None), если знак не выбран.
     code: 'aries' | 'taurus' | ... ; label: '♈ Овен' и т.п.
     """
-    u = get_user(user_id)
-    code = u["profile"].get("sign")
+    _ensure()
+    code = storage.get_sign(user_id)
     if code and code in ZODIAC:
         return code, ZODIAC[code]
     return None, None
@@ -101,7 +303,6 @@ def set_user_sign(user_id: int, code: str):
     """
     if code not in ZODIAC:
         return False
-    u = get_user(user_id)
-    u["profile"]["sign"] = code
-    put_user(user_id, u)
+    _ensure()
+    storage.set_sign(user_id, code)
     return True
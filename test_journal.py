@@ -0,0 +1,67 @@
+"""journal.py: проигрывание журнала поверх снимка и оборванная запись."""
+import json
+
+from journal import JournaledState
+
+
+def _journal_lines(state):
+    return [json.loads(line) for line in state.journal_path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_replay_after_restart(tmp_path):
+    state = JournaledState(tmp_path / "state.json")
+    state.set(["signs", "Лев", "today"], {"date": "2026-10-18"})
+    state.push(["signs", "Лев", "history"], 1, keep=2)
+    state.push(["signs", "Лев", "history"], 2, keep=2)
+    state.push(["signs", "Лев", "history"], 3, keep=2)
+    state.delete(["signs", "Лев", "today"])
+    state.close()
+
+    again = JournaledState(tmp_path / "state.json")
+    assert again.load() == {"signs": {"Лев": {"history": [2, 3]}}}
+
+
+def test_records_in_snapshot_are_skipped(tmp_path):
+    state = JournaledState(tmp_path / "state.json")
+    state.push(["log"], "a")
+    state.push(["log"], "b")
+    journal = state.journal_path.read_bytes()
+    state.compact()
+    state.push(["log"], "c")
+    state.close()
+    # падение между записью снимка и очисткой журнала: старые записи
+    # (seq <= seq снимка) снова оказываются в начале журнала
+    state.journal_path.write_bytes(journal + state.journal_path.read_bytes())
+
+    again = JournaledState(tmp_path / "state.json")
+    assert again.load() == {"log": ["a", "b", "c"]}
+    snapshot = json.loads(again.snapshot_path.read_text(encoding="utf-8"))
+    assert snapshot[JournaledState.SEQ_KEY] == 2
+
+
+def test_torn_last_line(tmp_path):
+    state = JournaledState(tmp_path / "state.json")
+    state.set(["a"], 1)
+    state.set(["b"], 2)
+    state.close()
+    raw = state.journal_path.read_bytes()
+    state.journal_path.write_bytes(raw[:-5])
+
+    again = JournaledState(tmp_path / "state.json")
+    assert again.load() == {"a": 1}
+    # load() файл не меняет — его читает и migrate.py при живом боте
+    assert state.journal_path.read_bytes() == raw[:-5]
+
+    again.set(["c"], 3)
+    again.close()
+    assert [rec["path"] for rec in _journal_lines(again)] == [["a"], ["c"]]
+    assert JournaledState(tmp_path / "state.json").load() == {"a": 1, "c": 3}
+
+
+def test_compact_every(tmp_path):
+    state = JournaledState(tmp_path / "state.json", compact_every=3)
+    for i in range(7):
+        state.set(["n"], i)
+    state.close()
+    assert len(_journal_lines(state)) == 1
+    assert JournaledState(tmp_path / "state.json").load() == {"n": 6}
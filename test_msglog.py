@@ -0,0 +1,86 @@
+"""msglog.py: восстановление после падения и сегменты по месяцам."""
+import os
+import time
+from datetime import datetime, timezone
+
+from msglog import INDEX, RECORD, MessageLog, month_key
+
+
+def ts(year: int, month: int, day: int = 1) -> int:
+    return int(datetime(year, month, day, 12, tzinfo=timezone.utc).timestamp())
+
+
+OCT = ts(2026, 10)
+
+
+def test_append_and_read(tmp_path):
+    log = MessageLog(tmp_path, limit=3)
+    for i in range(5):
+        log.append(1, f"m{i}", OCT)
+    log.append(2, "чужое", OCT)
+    assert log.read(1, month="2026-10") == [(OCT, "m2"), (OCT, "m3"), (OCT, "m4")]
+    log.replace(1, [(OCT, "new")], OCT)
+    assert log.read(1, month="2026-10") == [(OCT, "new")]
+    assert log.read(2, month="2026-10") == [(OCT, "чужое")]
+    log.close()
+
+    again = MessageLog(tmp_path, limit=3)
+    assert again.read(1, month="2026-10") == [(OCT, "new")]
+
+
+def test_torn_log_tail_is_cut(tmp_path):
+    log = MessageLog(tmp_path)
+    log.append_many([(1, "a"), (1, "b")], OCT)
+    log.close()
+    path = tmp_path / "2026-10.log"
+    size = path.stat().st_size
+    with path.open("ab") as f:
+        f.write(RECORD.pack(1, OCT, 100) + b"torn")
+
+    again = MessageLog(tmp_path)
+    assert again.read(1, month="2026-10") == [(OCT, "a"), (OCT, "b")]
+    assert path.stat().st_size == size
+    again.append(1, "c", OCT)
+    assert again.read(1, month="2026-10")[-1] == (OCT, "c")
+
+
+def test_missing_index_entries_are_rebuilt(tmp_path):
+    log = MessageLog(tmp_path)
+    log.append_many([(1, "a"), (2, "b"), (1, "c")], OCT)
+    log.close()
+    # падение после записи .log, но до .idx: индекс потерял хвост
+    idx = tmp_path / "2026-10.idx"
+    os.truncate(idx, INDEX.size + INDEX.size // 2)
+
+    again = MessageLog(tmp_path)
+    assert again.read(1, month="2026-10") == [(OCT, "a"), (OCT, "c")]
+    assert again.read(2, month="2026-10") == [(OCT, "b")]
+    assert idx.stat().st_size == 3 * INDEX.size
+
+
+def test_one_segment_per_month(tmp_path):
+    log = MessageLog(tmp_path, keep_months=2)
+    log.append(1, "aug", ts(2026, 8))
+    log.append(1, "sep", ts(2026, 9))
+    assert log.months() == ["2026-08", "2026-09"]
+    assert log.read(1, month="2026-08") == [(ts(2026, 8), "aug")]
+
+    log.append(1, "oct", OCT)
+    # новый месяц — новый файл, сегменты старше keep_months удалены
+    assert log.months() == ["2026-09", "2026-10"]
+    assert log.read(1, month="2026-10") == [(OCT, "oct")]
+    assert log.read(1, month="2026-09") == [(ts(2026, 9), "sep")]
+    assert log.read(1, month="2026-08") == []
+
+
+def test_two_writers_on_one_segment(tmp_path):
+    # replace_month() пишет только хранимые месяцы — берём текущий
+    now = int(time.time())
+    month = month_key(now)
+    bot = MessageLog(tmp_path)
+    migrate = MessageLog(tmp_path)
+    bot.append(1, "bot-1", now)
+    migrate.replace_month(month, {2: [(now, "old")]})
+    bot.append(1, "bot-2", now)
+    assert bot.read(2, month=month) == [(now, "old")]
+    assert migrate.read(1, month=month) == [(now, "bot-1"), (now, "bot-2")]
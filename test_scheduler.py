@@ -0,0 +1,81 @@
+"""scheduler.py: переходы DST и догон пропущенных напоминаний."""
+from datetime import datetime
+
+import pytz
+
+from scheduler import ReminderScheduler, _localize, next_fire, prev_fire
+
+TZ = pytz.timezone("Europe/Madrid")  # 2026: +1ч 29 марта, -1ч 25 октября
+
+
+def utc(*args) -> datetime:
+    return pytz.utc.localize(datetime(*args))
+
+
+def test_localize_ordinary():
+    at = _localize(TZ, datetime(2026, 6, 1, 9, 0))
+    assert at.astimezone(pytz.utc) == utc(2026, 6, 1, 7, 0)
+
+
+def test_localize_nonexistent_shifts_forward():
+    # 02:30 29 марта не существует — срабатываем в 03:30 летнего времени
+    at = _localize(TZ, datetime(2026, 3, 29, 2, 30))
+    assert (at.hour, at.minute) == (3, 30)
+    assert at.astimezone(pytz.utc) == utc(2026, 3, 29, 1, 30)
+
+
+def test_localize_ambiguous_takes_first():
+    # 02:30 25 октября бывает дважды — берём первое (ещё летнее)
+    at = _localize(TZ, datetime(2026, 10, 25, 2, 30))
+    assert at.astimezone(pytz.utc) == utc(2026, 10, 25, 0, 30)
+
+
+def test_next_fire_spring_gap():
+    assert next_fire(150, TZ, utc(2026, 3, 28, 23, 0)) == utc(2026, 3, 29, 1, 30)
+    # на следующий день 02:30 снова существует
+    assert next_fire(150, TZ, utc(2026, 3, 29, 1, 30)) == utc(2026, 3, 30, 0, 30)
+
+
+def test_next_fire_autumn_repeat_fires_once():
+    first = next_fire(150, TZ, utc(2026, 10, 24, 23, 0))
+    assert first == utc(2026, 10, 25, 0, 30)
+    # второе 02:30 того же дня (01:30 UTC) не срабатывает
+    assert next_fire(150, TZ, first) == utc(2026, 10, 26, 1, 30)
+
+
+def test_next_fire_follows_offset_change():
+    # 09:00 по Мадриду — 07:00 UTC летом и 08:00 UTC зимой
+    assert next_fire(540, TZ, utc(2026, 10, 24, 8, 0)) == utc(2026, 10, 25, 8, 0)
+    assert next_fire(540, TZ, utc(2026, 3, 28, 9, 0)) == utc(2026, 3, 29, 7, 0)
+
+
+def test_prev_fire_across_dst():
+    assert prev_fire(150, TZ, utc(2026, 3, 29, 12, 0)) == utc(2026, 3, 29, 1, 30)
+    assert prev_fire(540, TZ, utc(2026, 10, 25, 7, 59)) == utc(2026, 10, 24, 7, 0)
+
+
+def _scheduler(users, grace=3600):
+    return ReminderScheduler(lambda: users, lambda due: None, TZ, grace=grace)
+
+
+def test_load_catches_up_within_grace():
+    now = utc(2026, 10, 18, 7, 30)  # 09:30 по Мадриду
+    fired = utc(2026, 10, 18, 7, 0).timestamp()
+    users = {
+        "1": {"reminder_time": "09:00"},  # метки нет — догоняем
+        "2": {"reminder_time": "09:00", "reminder_sent_at": fired},  # уже ушло
+        "3": {"reminder_time": "09:00", "reminder_sent_at": fired - 86400},  # вчерашнее
+        "4": {"reminder_time": "07:00"},  # вне grace
+        "5": {"reminder_time": None},
+    }
+    missed = _scheduler(users).load(now)
+    assert sorted(key for key, _ in missed) == ["1", "3"]
+
+
+def test_pop_due_reschedules_next_day():
+    users = {"1": {"reminder_time": "09:00"}}
+    sched = _scheduler(users)
+    sched.load(utc(2026, 10, 24, 6, 0))
+    assert [key for key, _ in sched._pop_due(utc(2026, 10, 24, 7, 0).timestamp())] == ["1"]
+    # после перехода на зимнее время следующее — в 08:00 UTC
+    assert sched._heap[0][0] == utc(2026, 10, 25, 8, 0).timestamp()
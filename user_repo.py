@@ -0,0 +1,164 @@
+import os
+import json
+import asyncio
+import tempfile
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """
+    Пишем во временный файл рядом и подменяем целевой через rename.
+    Имя временного файла уникальное: два писателя одного path не делят tmp.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def minute_of_day(hhmm: Optional[str]) -> Optional[int]:
+    """'09:30' -> 570; None/битое значение -> None."""
+    if not hhmm or not isinstance(hhmm, str):
+        return None
+    try:
+        hour, minute = hhmm.split(":")
+        hour, minute = int(hour), int(minute)
+    except ValueError:
+        return None
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return hour * 60 + minute
+
+
+class UserRepository:
+    """
+    Резидентное хранилище пользователей бота.
+
+    Файл читается один раз при старте, чтения обслуживаются из памяти,
+    а изменённые записи сбрасываются на диск пачками: по таймеру
+    (flush_interval секунд) или досрочно, когда грязных записей
+    набралось batch_size. При остановке делается финальный flush.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 5.0, batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    # ------------------------------ чтение ------------------------------
+
+    def load(self) -> None:
+        if not self.path.exists():
+            self._users = {}
+            return
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._users = data if isinstance(data, dict) else {}
+        except Exception as e:
+            logger.error(f"Ошибка чтения {self.path}: {e}")
+            self._users = {}
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        """Все пользователи (живой словарь — не изменять снаружи)."""
+        return self._users
+
+    def get(self, chat_id: int) -> Dict[str, Any]:
+        return dict(self._users.get(str(chat_id), {}))
+
+    # ------------------------------ запись ------------------------------
+
+    def update(self, chat_id: int, **kwargs) -> Dict[str, Any]:
+        key = str(chat_id)
+        u = self._users.setdefault(key, {})
+        u.update(kwargs)
+        self._dirty.add(key)
+        if len(self._dirty) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return dict(u)
+
+    def _snapshot(self) -> Optional[str]:
+        if not self._dirty:
+            return None
+        self._dirty.clear()
+        return json.dumps(self._users, ensure_ascii=False, separators=(",", ":"))
+
+    def flush(self) -> None:
+        """Синхронный сброс (для остановки и скриптов)."""
+        dirty = set(self._dirty)
+        payload = self._snapshot()
+        if payload is None:
+            return
+        try:
+            atomic_write_text(self.path, payload)
+        except Exception as e:
+            self._dirty |= dirty
+            logger.error(f"Ошибка записи {self.path}: {e}")
+
+    async def flush_async(self) -> None:
+        # сериализуем в цикле событий (консистентный снимок),
+        # а саму запись на диск уносим в поток
+        dirty = set(self._dirty)
+        payload = self._snapshot()
+        if payload is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, atomic_write_text, self.path, payload)
+        except Exception as e:
+            self._dirty |= dirty
+            logger.error(f"Ошибка записи {self.path}: {e}")
+        except BaseException:
+            # отмена не останавливает поток с записью, но и не должна терять
+            # грязные ключи: финальный flush() запишет их ещё раз
+            self._dirty |= dirty
+            raise
+
+    # --------------------------- фоновый flush --------------------------
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_async()
+
+    def start(self) -> None:
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        # не отменяем задачу посреди записи: будим цикл и ждём, пока он
+        # допишет текущий снимок и выйдет, и только потом пишем остаток
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Ошибка фонового сброса {self.path}: {e}")
+            self._task = None
+        self.flush()